@@ -1,25 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import AliasChoices, BaseModel, Field
 from typing import Union, List, Optional 
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+from contextlib import asynccontextmanager
+import asyncio
 import json
+import os
 from datetime import datetime, timedelta, time
-from weather import get_weather_data
+from weather import get_weather_batch, get_weather_data, get_weather_series, weather_at_many, extent_stats, extent_flights, point_cache, position_flights, parameter_cache
 
+import edr
+import llm
 import mongo_calls as db
+import prefetch
+import suitability
+from validation import first_invalid_key
 
-# Load environment variables
-# Your key needs to be in the .env file in the root of the project, like this: OPENAI_API_KEY='<your key>'
-load_dotenv()
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
 model = "gpt-4-1106-preview"
 model_frontend = "gpt-3.5-turbo"
 
+# Maximum number of alternative slots checked at the same time by /new_time
+NEW_TIME_CONCURRENCY = int(os.environ.get("NEW_TIME_CONCURRENCY", "8"))
+# "single": /text extracts the task and writes the next message with one completion,
+# "legacy": one completion to extract and one to ask or summarize
+TEXT_EXTRACTION_MODE = os.environ.get("TEXT_EXTRACTION_MODE", "single")
+# Maximum number of lines /text_list extracts at the same time
+TEXT_LIST_CONCURRENCY = int(os.environ.get("TEXT_LIST_CONCURRENCY", "8"))
+# Maximum number of tasks /weather/batch judges at the same time, only matters when the LLM has to decide
+WEATHER_BATCH_CONCURRENCY = int(os.environ.get("WEATHER_BATCH_CONCURRENCY", "8"))
+
 default_task = {
     "title": "Event Title describing the event",
     "date": "yyyy-mm-dd",
@@ -32,7 +42,19 @@ default_task = {
     "indoor": "Boolean describing if the event takes place indoors or not."
 }
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared clients live as long as the worker, connections are reused by all requests
+    await db.connect()
+    prefetcher = prefetch.start()
+    yield
+    await prefetch.stop(prefetcher)
+    db.close()
+    await edr.close()
+    await llm.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Set up CORS middleware
 app.add_middleware(
@@ -41,6 +63,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Next-Cursor"],  # Pagination cursor of GET /task
 )
 
 # Models
@@ -74,6 +97,9 @@ class UpdateTextRequest(BaseModel):
     task: Optional[IntermidiateTask] = None
     messages: List[str]
 
+class WeatherBatchRequest(BaseModel):
+    tasks: List[Task]
+
 class WeatherRequest(BaseModel):
     longitude: float
     latitude: float
@@ -83,60 +109,253 @@ class TextRequest(BaseModel):
     text: str
 
 class TextListRequest(BaseModel):
-    text: List [str]
+    text: List [str] = Field(validation_alias=AliasChoices("text", "texts"))
+
+async def get_username(x_user: Optional[str] = Header(None)) -> str:
+    """
+    Every user has their own task collection. The user is taken from the X-User header,
+    requests without one use the default collection.
+
+    The header is not authenticated: it selects a collection, it does not prove who the caller is.
+    Any client that can reach the API can read, replace or delete the tasks of any user by sending their name.
+    Only expose the API behind a gateway that authenticates the caller and sets X-User itself.
+    """
+    username = x_user or db.DEFAULT_USERNAME
+    if not db.valid_username(username):
+        raise HTTPException(status_code=400, detail="Invalid X-User header")
+    return username
+
 
 @app.get("/")
 async def read_root():
     return {"message": "Hello World"}
 
+
+@app.get("/stats")
+async def read_stats():
+    """
+    Returns the hit/miss counters of the in-process caches.
+    """
+    return {
+        "extent_cache": {**extent_stats, "single_flight": extent_flights.stats()},
+        "point_cache": {**point_cache.stats(), "single_flight": position_flights.stats()},
+        "parameter_cache": parameter_cache.stats(),
+        "llm_cache": llm.get_cache_stats(),
+        "prefetch": prefetch.prefetch_stats,
+    }
+
 # Endpoints
 @app.post("/task/", response_description="Add new task", response_model=Task)
-async def create_task(task: Task):
-    task = await db.add_task(task.model_dump())
+async def create_task(task: Task, username: str = Depends(get_username)):
+    task = await db.add_task(task.model_dump(), username=username)
     if task is not None:
         return task
     raise HTTPException(status_code=500, detail="Task could not be created")
 
 
-@app.post("/task/many/", response_description="Add new tasks")
-async def create_task(task_list: List [Task]):
-    task = await db.add_multiple_tasks([t.model_dump() for t in task_list])
-    raise HTTPException(status_code=500, detail="Task could not be created")
+# The body of /task/many/ is read from the raw request, so FastAPI cannot derive its schema
+TASK_BULK_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": Task.model_json_schema()}},
+            "application/x-ndjson": {"schema": {"type": "string", "description": "One task per line, as in the JSON array."}},
+        },
+    }
+}
+
+
+@app.post("/task/many/", response_description="Add or replace many tasks", openapi_extra=TASK_BULK_REQUEST_BODY)
+async def create_tasks(request: Request, username: str = Depends(get_username)):
+    """
+    Bulk import of tasks, either as a JSON array of tasks or as NDJSON (Content-Type: application/x-ndjson),
+    one task per line. NDJSON uploads are written chunk by chunk while they are received.
+
+    Tasks with a taskId replace the stored task with that id or are inserted, tasks without one are inserted.
+    Returns the counts and one status per task in input order:
+    {"inserted": int, "updated": int, "failed": int, "items": [{"index": int, "status": str, "error": str}]}
+    """
+    items = []
+
+    async def write(chunk):
+        # chunk holds (index, task) pairs, where task is the error message if the task is invalid
+        valid = [(index, task) for index, task in chunk if isinstance(task, dict)]
+        statuses = await db.bulk_upsert_tasks([task for _, task in valid], chunk_size=len(valid) or None, username=username)
+        for (index, _), status in zip(valid, statuses):
+            items.append({"index": index, **status})
+        for index, task in chunk:
+            if isinstance(task, str):
+                items.append({"index": index, "status": "failed", "error": task})
+
+    def parse(index, data):
+        try:
+            return index, Task.model_validate(data).model_dump()
+        except Exception as e:
+            return index, str(e)
+
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        chunk, index, buffer = [], 0, b""
+        async for data in request.stream():
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    chunk.append(parse(index, json.loads(line)))
+                except ValueError as e:
+                    chunk.append((index, str(e)))
+                index += 1
+                if len(chunk) >= db.TASK_BULK_CHUNK_SIZE:
+                    await write(chunk)
+                    chunk = []
+        if buffer.strip():
+            try:
+                chunk.append(parse(index, json.loads(buffer)))
+            except ValueError as e:
+                chunk.append((index, str(e)))
+        if chunk:
+            await write(chunk)
+    else:
+        try:
+            task_list = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not isinstance(task_list, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of tasks")
+        for start in range(0, len(task_list), db.TASK_BULK_CHUNK_SIZE):
+            await write([parse(start + offset, data) for offset, data in enumerate(task_list[start:start + db.TASK_BULK_CHUNK_SIZE])])
+
+    items.sort(key=lambda item: item["index"])
+    return {
+        "inserted": sum(item["status"] == "inserted" for item in items),
+        "updated": sum(item["status"] == "updated" for item in items),
+        "failed": sum(item["status"] == "failed" for item in items),
+        "items": items,
+    }
+
 
+@app.get("/task", response_description="List tasks")
+async def list_tasks(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = None,
+    sort: str = "taskID",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    activity: Optional[str] = None,
+    indoor: Optional[bool] = None,
+    fields: Optional[str] = None,
+    username: str = Depends(get_username),
+):
+    """
+    Lists one page of tasks, sorted by taskID or date.
 
-@app.get("/task", response_description="List all tasks", response_model=List[Task])
-async def list_tasks():
-    tasks = await db.retrieve_tasks()
+    Filters: date_from and date_to (yyyy-mm-dd, inclusive), activity and indoor.
+    fields is a comma separated list of keys to return for each task, e.g. fields=title,date.
+    If there are more tasks, the cursor of the next page is returned in the X-Next-Cursor header.
+    """
+    try:
+        tasks, next_cursor = await db.find_tasks(
+            limit=limit,
+            cursor=cursor,
+            sort=sort,
+            fields=fields.split(",") if fields else None,
+            date_from=date_from,
+            date_to=date_to,
+            activity=activity,
+            indoor=indoor,
+            username=username,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if tasks is not None:
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
         return tasks
     raise HTTPException(status_code=500, detail="Error retrieving tasks list")
 
 
+@app.get("/task/export", response_description="Export tasks as NDJSON")
+async def export_tasks(
+    batch_size: Optional[int] = Query(None, ge=1, le=10000),
+    sort: str = "taskID",
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    activity: Optional[str] = None,
+    indoor: Optional[bool] = None,
+    username: str = Depends(get_username),
+):
+    """
+    Streams all tasks matching the filters as NDJSON, one task per line, while they are read from the database.
+    Takes the same filters as GET /task. batch_size is the number of tasks fetched per database round trip.
+    """
+    if sort not in db.TASK_SORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown sort order {sort}")
+    tasks = db.stream_tasks(batch_size=batch_size, sort=sort, date_from=date_from, date_to=date_to, activity=activity, indoor=indoor, username=username)
+
+    async def lines():
+        async for task in tasks:
+            yield json.dumps(task, default=str) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.put("/task", response_description="Update a task")
-async def update_task(new_task: Task):
-    task = await db.update_task(new_task.model_dump())
+async def update_task(new_task: Task, username: str = Depends(get_username)):
+    task = await db.update_task(new_task.model_dump(), username=username)
     if task is not None:
+        if task:
+            # only a task that was actually replaced lost its stored verdict
+            prefetch.recheck(new_task.model_dump(), username)
         return task
     raise HTTPException(status_code=500, detail="Task could not be replaced")
 
 
 @app.put("/task/{id}", response_description="Delete a task")
-async def delete_task(id : int):
-    deleted_task = await db.delete_task(id)
+async def delete_task(id : int, username: str = Depends(get_username)):
+    deleted_task = await db.delete_task(id, username=username)
     if deleted_task is not None:
         return deleted_task
     raise HTTPException(status_code=500, detail="Task could not be deleted")
 
 
 @app.post("/text_list")
-async def analyze_text_list(text_request: TextListRequest):
-    results = []
-    for text in text_request.text.split('\n'):
-        line = TextRequest(text=text)
-        result = await analyze_text(line)
-        results.append(result)
-    print(results)
-    return results
+async def analyze_text_list(text_request: TextListRequest, stream: bool = False):
+    """
+    Analyzes many texts at once, each line of each text is one event.
+
+    The lines are extracted concurrently, at most TEXT_LIST_CONCURRENCY at a time. A failing line does not fail
+    the batch, it is reported with an "error" instead of a "result".
+
+    Returns a list of {"index": int, "text": str, "result": {...}} or {"index": int, "text": str, "error": str}
+    in input order. With ?stream=true every item is sent as an NDJSON line as soon as it is done instead.
+    """
+    lines = [line for text in text_request.text for line in text.split('\n') if line.strip()]
+    semaphore = asyncio.Semaphore(TEXT_LIST_CONCURRENCY)
+
+    async def analyze_line(index, line):
+        async with semaphore:
+            try:
+                result = await analyze_text(UpdateTextRequest(messages=[line]))
+                return {"index": index, "text": line, "result": result}
+            except Exception as e:
+                return {"index": index, "text": line, "error": str(e)}
+
+    if not stream:
+        return await asyncio.gather(*[analyze_line(index, line) for index, line in enumerate(lines)])
+
+    async def results():
+        pending = [asyncio.ensure_future(analyze_line(index, line)) for index, line in enumerate(lines)]
+        try:
+            for finished in asyncio.as_completed(pending):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            # the client may disconnect before all lines are done
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
 
 
 @app.post("/text")
@@ -161,113 +380,29 @@ async def analyze_text(inter_task_and_text: UpdateTextRequest):
         task: {}
         message: ""
     }
+
+    With TEXT_EXTRACTION_MODE=single (the default) the task, its missing entries and the message are produced by one
+    completion, with TEXT_EXTRACTION_MODE=legacy by separate completions.
       
     Raises:
     - HTTPException: An error response with status code 500 if there is an issue with the OpenAI API call.
     """
     
-    template_str = json.dumps(default_task)
-    
     task = inter_task_and_text.task
     chat = inter_task_and_text.messages
 
-    completion = None
-
-    if task is None:
-        # first try to fill the json
-        completion = client.chat.completions.create(
-            model=model_frontend,
-            response_format={ "type": "json_object" },
-            messages=[
-                {"role": "system", "content": f"You are an assistant that extracts information from text. You receive as input a text and you will extract information from it and fill out a template based on it. The values in the json template describe what the keys should store. You return nothing other than the filled-out template in valid json format. Any value that you cannot fill in, you will fill with the word EMPTY as a string. Do not make up information that you cannnot extract from the user input. However, if you can guess the event description or if the event is indoor from its title or description, please fill out these entries. If no information about location is given, fill in EMPTY for longitude and latitude. Today is {datetime.now().strftime('%Y-%m-%d')}."},
-                {"role": "user", "content": f"{chat[-1]}"},
-                {"role": "system", "content": f"The template is: {template_str}"} 
-            ]
-        )
+    if TEXT_EXTRACTION_MODE == "single":
+        task, success, analysis_message_content = await extract_task_single(task, chat)
     else:
-        # try to update the json file
-        user_answer = chat[-1]
-        bot_question = chat[-2]
-        completion = client.chat.completions.create(
-            model=model_frontend,
-            response_format={ "type": "json_object" },
-            messages=[
-                {"role": "system", "content": f"You are an assistant that updates a template with new information. You receive as input a question that was asked to the user and its response. Additionally you will get a json template that the user has partially filled out and a json template that describe for each entry what they need to be filled with. You will extract the information from the user response and fill out a template based on it. You return nothing other than the filled-out template in valid json format. The entries not filled by the user are marked with the word EMPTY. Any value that was EMPTY and you cannot fill in, you will leave with the word EMPTY. Do not make up information that you cannnot extract from the user input. If it is possible to guess an event description or if the event is indoor or not, please do so. For longitude and latitude, if a location is given, fill in some estimate for those values. Only fill in longitude and latitude if location information is given. Today is {datetime.now().strftime('%Y-%m-%d')}."},
-                {"role": "system", "content": f"The bots question was: {bot_question}"},
-                {"role": "system", "content": f"The users answer was: {user_answer}"},
-                {"role": "system", "content": f"The initial template describing what each entry should hold is: {template_str}"},
-                {"role": "user", "content": f"The template which entries that are EMPTY need to be filled: {task}"} 
-            ]
-        )
-        
-    completion_message_content = completion.choices[0].message.content
-    task = json.loads(completion_message_content) 
+        task, success, analysis_message_content = await extract_task(task, chat)
         
-    success = True
-    
-    if "title" not in task:
-        task["tite"] = "EMPTY"
-    if "date" not in task:
-        task["date"] = "EMPTY"
-    if "startTime" not in task:
-        task["startTime"] = "EMPTY"
-    if "endTime" not in task:
-        task["endTime"] = "EMPTY"
-    if "activity" not in task:
-        task["activity"] = "EMPTY"
-    if "description" not in task:
-        task["description"] = "EMPTY"
-    if "latitude" not in task:
-        task["latitude"] = "EMPTY"
-    if "longitude" not in task:
-        task["longitude"] = "EMPTY"
-
-    # Iterate over key, value pairs in the first dictionary
-    for key, value in task.items():
-        # Check if the key is in the second dictionary and has a different value
-        if value == "EMPTY":
-            success = False
-        if key == "taskId":
-            continue
+    return finalize_task(task, success, analysis_message_content)
 
-    if success:
-        check = client.chat.completions.create(
-            model=model_frontend,
-            messages=[
-                {"role": "system", "content": f"You are an assistant that checks if a json was filled out correctly. You receive as input a filled json template and the template which also describes which entry should hold what value. You check if the template was filled correctly. If so, you answer with the number 1. If it was filled out wrong you answer with the number 0. You answer with this number without asking further questions and without giving any reasoning. Types are unimportant, we are only interested in content and format."},
-                {"role": "system", "content": f"The initial template describing what each entry should hold is: {template_str}"},
-                {"role": "user", "content": f"The template which entries need to be checked is: {task}"} 
-            ]
-        )
-        
-        if '0' in check.choices[0].message.content and '1' not in check.choices[0].message.content:
-            final_result = {}
-            final_result["success"] = False
-            final_result["task"] = None
-            final_result["message"] = "Unfortunately, something went wrong. Your event was prematurely checked as success by AI. Please try to create the event again."
-            return final_result
-    
-    # analysis
-    analysis = None
-    if not success:
-        analysis = client.chat.completions.create(
-            model=model_frontend,
-            messages=[
-                {"role": "system", "content": f"You are an assistant that asks a user to complete a json template. You receive as input a partially filled json template. The unfilled entries are marked with the word EMPTY or are invalid entries. You search for the first such entry and return a message to politely ask the user to give more information which you would need to fill out this entry. Do not respond with anything other than the request to the user. Only ask for one information from the user at one time! For longitudinal and latitudinal information, ask for the location instead. Ask as simple questions as possible. Do not mention that you are filling out a JSON file."},
-                {"role": "user", "content": f"The template is: {task}"} 
-            ]
-        )
-    else:
-        analysis = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": f"You are an assisstant communication with the user. You  are given a json template describing an event, need to summarize it for the user and tell the user that the event creation was successfull. Only answer with what you have been instructed to. Do not make up something. Be nice to the user."},
-                {"role": "user", "content": f"The json is: {task}"} 
-            ]
-        )
-        
-    analysis_message_content = analysis.choices[0].message.content
-        
+
+def finalize_task(task: dict, success: bool, analysis_message_content: str) -> dict:
+    """
+    Converts the entries of an extracted task to the types the frontend expects and builds the /text response.
+    """
     final_result = {}
     
     print(task)
@@ -315,6 +450,234 @@ async def analyze_text(inter_task_and_text: UpdateTextRequest):
     return final_result
 
 
+# Question asked for an entry that is still missing when the model did not ask for it itself
+FOLLOW_UP_QUESTIONS = {
+    "title": "What would you like to call the event?",
+    "date": "On which day does the event take place?",
+    "startTime": "At what time does the event start?",
+    "endTime": "At what time does the event end?",
+    "activity": "What kind of activity is it (coffee, drink, eat, meeting, party, running, walking, working or other)?",
+    "description": "Could you describe the event in a few words?",
+    "latitude": "Where does the event take place?",
+    "longitude": "Where does the event take place?",
+    "indoor": "Does the event take place indoors?",
+}
+# Question asked when it is not clear which entry is missing
+GENERIC_FOLLOW_UP = "Could you give me more details about the event?"
+
+
+def check_task(task: dict) -> bool:
+    """
+    Marks missing and invalid entries of an extracted task as EMPTY and returns whether it is complete.
+    """
+    for key in ["title", "date", "startTime", "endTime", "activity", "description", "latitude", "longitude"]:
+        if key not in task:
+            task[key] = "EMPTY"
+
+    success = all(value != "EMPTY" for key, value in task.items() if key != "taskId")
+
+    if success:
+        # a missing indoor entry defaults to False, everything else has to be filled in correctly
+        invalid = first_invalid_key({"indoor": False, **task})
+        if invalid is not None:
+            # ask the user for the invalid entry like for an empty one
+            print(f"Invalid entry {invalid[0]}: {invalid[1]}")
+            task[invalid[0]] = "EMPTY"
+            success = False
+    return success
+
+
+def first_empty_key(task: dict) -> Optional[str]:
+    for key in default_task:
+        if task.get(key, "EMPTY") == "EMPTY":
+            return key
+    return None
+
+
+async def extract_task(task, chat):
+    """
+    Fills the template from the last chat message with up to two completions: one to extract the task and one
+    to either ask for the first missing entry or to summarize the event.
+
+    Returns (task, success, message).
+    """
+    template_str = json.dumps(default_task)
+
+    completion_message_content = None
+
+    if task is None:
+        # first try to fill the json
+        completion_message_content = await llm.complete(
+            model=model_frontend,
+            cache=True,
+            response_format={ "type": "json_object" },
+            messages=[
+                {"role": "system", "content": f"You are an assistant that extracts information from text. You receive as input a text and you will extract information from it and fill out a template based on it. The values in the json template describe what the keys should store. You return nothing other than the filled-out template in valid json format. Any value that you cannot fill in, you will fill with the word EMPTY as a string. Do not make up information that you cannnot extract from the user input. However, if you can guess the event description or if the event is indoor from its title or description, please fill out these entries. If no information about location is given, fill in EMPTY for longitude and latitude. Today is {datetime.now().strftime('%Y-%m-%d')}."},
+                {"role": "user", "content": f"{chat[-1]}"},
+                {"role": "system", "content": f"The template is: {template_str}"} 
+            ]
+        )
+    else:
+        # try to update the json file
+        user_answer = chat[-1]
+        bot_question = chat[-2]
+        completion_message_content = await llm.complete(
+            model=model_frontend,
+            response_format={ "type": "json_object" },
+            messages=[
+                {"role": "system", "content": f"You are an assistant that updates a template with new information. You receive as input a question that was asked to the user and its response. Additionally you will get a json template that the user has partially filled out and a json template that describe for each entry what they need to be filled with. You will extract the information from the user response and fill out a template based on it. You return nothing other than the filled-out template in valid json format. The entries not filled by the user are marked with the word EMPTY. Any value that was EMPTY and you cannot fill in, you will leave with the word EMPTY. Do not make up information that you cannnot extract from the user input. If it is possible to guess an event description or if the event is indoor or not, please do so. For longitude and latitude, if a location is given, fill in some estimate for those values. Only fill in longitude and latitude if location information is given. Today is {datetime.now().strftime('%Y-%m-%d')}."},
+                {"role": "system", "content": f"The bots question was: {bot_question}"},
+                {"role": "system", "content": f"The users answer was: {user_answer}"},
+                {"role": "system", "content": f"The initial template describing what each entry should hold is: {template_str}"},
+                {"role": "user", "content": f"The template which entries that are EMPTY need to be filled: {task}"} 
+            ]
+        )
+        
+    task = json.loads(completion_message_content) 
+    success = check_task(task)
+    
+    # analysis
+    analysis_message_content = None
+    if not success:
+        analysis_message_content = await llm.complete(
+            model=model_frontend,
+            messages=[
+                {"role": "system", "content": f"You are an assistant that asks a user to complete a json template. You receive as input a partially filled json template. The unfilled entries are marked with the word EMPTY or are invalid entries. You search for the first such entry and return a message to politely ask the user to give more information which you would need to fill out this entry. Do not respond with anything other than the request to the user. Only ask for one information from the user at one time! For longitudinal and latitudinal information, ask for the location instead. Ask as simple questions as possible. Do not mention that you are filling out a JSON file."},
+                {"role": "user", "content": f"The template is: {task}"} 
+            ]
+        )
+    else:
+        analysis_message_content = await llm.complete(
+            model=model,
+            messages=[
+                {"role": "system", "content": f"You are an assisstant communication with the user. You  are given a json template describing an event, need to summarize it for the user and tell the user that the event creation was successfull. Only answer with what you have been instructed to. Do not make up something. Be nice to the user."},
+                {"role": "user", "content": f"The json is: {task}"} 
+            ]
+        )
+
+    return task, success, analysis_message_content
+
+
+# Output formats of the single extraction completion, as json object or as message followed by the task for streaming
+SINGLE_OUTPUT_JSON = 'You return nothing other than a valid json object of the form {"task": <filled-out template>, "missing": [<keys of the entries that are EMPTY>], "message": <the message to the user>}.'
+TASK_MARKER = "###TASK###"
+SINGLE_OUTPUT_STREAM = f'You first write the message to the user as plain text. Then you write a line containing only {TASK_MARKER}, followed by nothing other than a valid json object of the form {{"task": <filled-out template>, "missing": [<keys of the entries that are EMPTY>]}}.'
+
+
+def single_extraction_messages(task, chat, output_format=SINGLE_OUTPUT_JSON) -> List[dict]:
+    template_str = json.dumps(default_task)
+    messages = [
+        {"role": "system", "content": f"You are an assistant that helps a user to create an event. You fill out a json template from the conversation with the user. The values in the json template describe what the keys should store. Any value that you cannot fill in, you fill with the word EMPTY as a string. Do not make up information that you cannnot extract from the user input. However, if you can guess the event description or if the event is indoor from its title or description, please fill out these entries. For longitude and latitude, if a location is given, fill in some estimate for those values, otherwise fill in EMPTY. Then write the next message to the user: If any entry is EMPTY, politely ask the user for the information needed for the first such entry. Only ask for one information at one time, ask for the location instead of longitude and latitude, ask as simple questions as possible and do not mention that you are filling out a JSON file. If no entry is EMPTY, summarize the event for the user and tell the user that the event creation was successfull. Be nice to the user. {output_format} Today is {datetime.now().strftime('%Y-%m-%d')}."},
+        {"role": "system", "content": f"The template is: {template_str}"},
+    ]
+    if task is not None:
+        messages.append({"role": "system", "content": f"The template filled out so far, entries that are EMPTY still need to be filled: {task}"})
+        if len(chat) > 1:
+            messages.append({"role": "assistant", "content": f"{chat[-2]}"})
+    messages.append({"role": "user", "content": f"{chat[-1]}"})
+    return messages
+
+
+def read_single_extraction(result: dict):
+    """
+    Checks the answer of a single extraction completion locally.
+    Returns (task, success, message). An answer that is not shaped like SINGLE_OUTPUT_JSON counts as an empty task.
+    """
+    if not isinstance(result, dict) or not isinstance(result.get("task") or {}, dict):
+        return {key: "EMPTY" for key in default_task}, False, GENERIC_FOLLOW_UP
+    task = result.get("task") or {}
+    message = result.get("message") or ""
+    missing = result.get("missing") if isinstance(result.get("missing"), list) else []
+    missing = [key for key in missing if isinstance(key, str) and key in default_task]
+    for key in missing:
+        task[key] = "EMPTY"
+    success = check_task(task)
+    if not success and not missing:
+        # the model wrote a success summary, but the local check found an entry that is missing or invalid
+        message = FOLLOW_UP_QUESTIONS.get(first_empty_key(task), GENERIC_FOLLOW_UP)
+    return task, success, message
+
+
+async def extract_task_single(task, chat):
+    """
+    Fills the template and writes the next message to the user (follow-up question or success summary)
+    with one schema-constrained completion. The result is checked locally with check_task.
+
+    Returns (task, success, message).
+    """
+    completion_message_content = await llm.complete(
+        model=model_frontend,
+        cache=True,
+        response_format={ "type": "json_object" },
+        messages=single_extraction_messages(task, chat)
+    )
+    return read_single_extraction(json.loads(completion_message_content))
+
+
+def marker_prefix_length(text: str) -> int:
+    """
+    Returns the length of the longest end of text that could be the beginning of TASK_MARKER.
+    """
+    for length in range(min(len(TASK_MARKER) - 1, len(text)), 0, -1):
+        if text.endswith(TASK_MARKER[:length]):
+            return length
+    return 0
+
+
+async def stream_extraction(task, chat):
+    """
+    Same as extract_task_single, but streams the message to the user while it is generated.
+
+    Yields ("token", text) for every piece of the message and finally ("task", /text response).
+    The message of the final response is authoritative, the local check may have replaced a premature summary.
+    """
+    message, buffer, task_part, in_task = "", "", "", False
+    async for delta in llm.stream_complete(model=model_frontend, messages=single_extraction_messages(task, chat, SINGLE_OUTPUT_STREAM)):
+        if in_task:
+            task_part += delta
+            continue
+        buffer += delta
+        if TASK_MARKER in buffer:
+            text, task_part = buffer.split(TASK_MARKER, 1)
+            in_task = True
+        else:
+            # hold back what could be the beginning of the marker
+            keep = marker_prefix_length(buffer)
+            text, buffer = buffer[:len(buffer) - keep], buffer[len(buffer) - keep:]
+        if text:
+            message += text
+            yield "token", text
+    if not in_task and buffer:
+        message += buffer
+        yield "token", buffer
+    try:
+        result = json.loads(task_part)
+    except ValueError:
+        result = {}
+    if isinstance(result, dict):
+        result["message"] = message.strip()
+    task, success, message = read_single_extraction(result)
+    yield "task", finalize_task(task, success, message)
+
+
+@app.post("/text/stream")
+async def analyze_text_stream(inter_task_and_text: UpdateTextRequest):
+    """
+    Server-Sent-Events variant of /text: the message to the user is streamed token by token as "token" events
+    with data {"text": str}, the final /text response ({success, task, message}) follows as a "task" event.
+    Failures end the stream with an "error" event with data {"detail": str}.
+    """
+    async def events():
+        try:
+            async for event, data in stream_extraction(inter_task_and_text.task, inter_task_and_text.messages):
+                data = {"text": data} if event == "token" else data
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 @app.post("/propose")
 async def propose_new_date(old_text: dict, new_proposed_date: dict):
     """
@@ -337,8 +700,9 @@ async def propose_new_date(old_text: dict, new_proposed_date: dict):
     old_str = json.dumps(old_text)
     new_str = json.dumps(new_proposed_date)
     try:
-        completion = client.chat.completions.create(
+        completion_message_content = await llm.complete(
             model=model,
+            cache=True,
             response_format={ "type": "json_object" },
             messages=[
                 {"role": "system", "content": f"You are an automated system that formulates a rescheduling because the weather is bad during the original activity plan. Based on input information for an event and a new proposed time, you will write a short text where you propose the new time for the activity. An example might be: 'Due to rain during this time, you might want to reschedule your meeting for tomorrow'. Today is {datetime.now().strftime('%Y-%m-%d')}."},
@@ -348,7 +712,6 @@ async def propose_new_date(old_text: dict, new_proposed_date: dict):
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    completion_message_content = completion.choices[0].message.content
     return {"result": completion_message_content}
 
 def convert_to_iso8601(json_dict):
@@ -368,37 +731,114 @@ def convert_to_iso8601(json_dict):
     
     return start_datetime, end_datetime
 
+# Answer of /weather and /weather/batch when no forecast could be fetched for a task
+NO_FORECAST = {"suitable": False, "reason": "No forecast is available for this time."}
+
+
 @app.post("/weather")
-async def get_weather(task: Task):
+async def get_weather(task: Task, username: str = Depends(get_username)):
     """
     Input: Task
     Output: Good/Bad
+
+    Stored tasks that were already checked with the current forecast run and the same entries are answered
+    from the database. Other verdicts of stored tasks are saved for the next call.
     """
     task = task.model_dump()
     if task["indoor"] is True:
         return {"suitable": "True", "reason": "The event is indoor."}
+    try:
+        verdict = await prefetch.stored_verdict(task, username)
+    except Exception as e:
+        print(e)
+        verdict = None
+    if verdict is not None:
+        return verdict
     from_date, to_date = convert_to_iso8601(task)
     print(from_date, to_date)
     try:
-        weather_data = get_weather_data(task["latitude"], task["longitude"], from_date, to_date, task["description"])
+        weather_data = await get_weather_data(task["latitude"], task["longitude"], from_date, to_date, task["description"], task["activity"])
     except Exception as e:
         print(e)
         return {"suitable": False, "reason": "Event has already started."}
+    if weather_data is None:
+        # nothing to judge: neither ask the LLM nor store a verdict for this forecast run
+        return NO_FORECAST
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            response_format={ "type": "json_object" },
-            messages=[
-                {"role": "system", "content": "You are an automated system that checks the weather for an event. Based on the input information for the event and the weather data for this time, you will determine if the weather is suitable for the activity. You will return a response indicating whether the weather is good or bad for the event of the form {suitable: 'True / False', reason: 'reason for decision'}. In your reasoning, explain how the provided parameters impaced your decision making. Make sure to return a valid json object."},
-                {"role": "user", "content": f"Task: {task}"}, 
-                {"role": "user", "content": f"Weather data: {weather_data}"}
-            ]
-        )
+        verdict = await check_suitability(task, weather_data)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    print(completion.choices[0].message.content)
-    response = json.loads(completion.choices[0].message.content)
-    response['suitable'] = response['suitable'] == 'True'
+    try:
+        await prefetch.store_verdict(task, verdict["suitable"], verdict["reason"], username)
+    except Exception as e:
+        print(e)
+    return verdict
+
+
+@app.post("/weather/batch")
+async def get_weather_batch_endpoint(batch: WeatherBatchRequest):
+    """
+    Checks the weather of many tasks at once. Their locations are fetched per grid cell with a few
+    multi-point requests instead of two requests per task.
+
+    Returns a list of {"taskId": int, "suitable": bool, "reason": str} or {"taskId": int, "error": str} in input order.
+    """
+    tasks = [task.model_dump() for task in batch.tasks]
+    results = [None] * len(tasks)
+    outdoor, events = [], []
+    for index, task in enumerate(tasks):
+        if task["indoor"] is True:
+            results[index] = {"taskId": task["taskId"], "suitable": True, "reason": "The event is indoor."}
+            continue
+        try:
+            from_date, to_date = convert_to_iso8601(task)
+        except ValueError as e:
+            results[index] = {"taskId": task["taskId"], "error": str(e)}
+            continue
+        outdoor.append(index)
+        events.append((task["latitude"], task["longitude"], from_date, to_date, task["description"], task["activity"]))
+
+    weather_data = await get_weather_batch(events)
+    semaphore = asyncio.Semaphore(WEATHER_BATCH_CONCURRENCY)
+
+    async def check(task, data):
+        if data is None:
+            return {"taskId": task["taskId"], **NO_FORECAST}
+        async with semaphore:
+            try:
+                return {"taskId": task["taskId"], **await check_suitability(task, data)}
+            except Exception as e:
+                return {"taskId": task["taskId"], "error": str(e)}
+
+    checked = await asyncio.gather(*(check(tasks[index], data) for index, data in zip(outdoor, weather_data)))
+    for index, result in zip(outdoor, checked):
+        results[index] = result
+    return results
+
+
+async def check_suitability(task: dict, weather_data: dict) -> dict:
+    """
+    Decides with the local rules if the weather is suitable for the task.
+    Only if the rules cannot decide (e.g. parameters are missing) the LLM is asked.
+
+    Returns {"suitable": bool, "reason": str}.
+    """
+    suitable, reason = suitability.evaluate(task["activity"], weather_data)
+    if suitable is not None:
+        return {"suitable": suitable, "reason": reason}
+    completion_message_content = await llm.complete(
+        model=model,
+        cache=True,
+        response_format={ "type": "json_object" },
+        messages=[
+            {"role": "system", "content": "You are an automated system that checks the weather for an event. Based on the input information for the event and the weather data for this time, you will determine if the weather is suitable for the activity. You will return a response indicating whether the weather is good or bad for the event of the form {suitable: boolean, reason: 'reason for decision'}. In your reasoning, explain how the provided parameters impaced your decision making. Make sure to return a valid json object."},
+            {"role": "user", "content": f"Task: {task}"}, 
+            {"role": "user", "content": f"Weather data: {weather_data}"}
+        ]
+    )
+    print(completion_message_content)
+    response = json.loads(completion_message_content)
+    response['suitable'] = response['suitable'] in (True, 'True', 'true')
     return response
 
 @app.post("/new_time")
@@ -425,36 +865,58 @@ async def propose_new_time(task: Task):
                 alternative_times.append(new_date)
     for i in range(3, round(hours_difference), 3):
         if i > 0:
-            new_date = now - timedelta(hours=i)
+            new_date = from_date - timedelta(hours=i)
             new_is_day = day_start <= new_date.time() <= day_end
             if original_is_day == new_is_day:
                 alternative_times.append(new_date)
-    # Check weather suitability for each alternative time
-    for new_date in alternative_times:
-        weather_data = get_weather_data(task_dict["latitude"], task_dict["longitude"], new_date, new_date + timedelta(hours=1), task_dict["description"])
-        try:
-            completion = client.chat.completions.create(
-                model=model,
-                response_format={ "type": "json_object" },
-                messages=[
-                    {"role": "system", "content": "You are an automated system that checks the weather for an event. Based on the input information for the event and the weather data for this time, you will determine if the weather is suitable for the activity. You will return a response indicating whether the weather is good or bad for the event of the form {suitable: boolean, reason: 'reason for decision'}. In your reasoning, explain how the provided parameters impaced your decision making. Make sure to return a valid json object."},
-                    {"role": "user", "content": f"Task: {task}"}, 
-                    {"role": "user", "content": f"Weather data: {weather_data}"}
-                ]
-            )
-            response = json.loads(completion.choices[0].message.content) 
-            suitable = response["suitable"]
-            print(new_date.strftime( "%H:%M"))
-            print((new_date + (to_date - from_date)).strftime( "%H:%M"))
-            if suitable:
-                return {"startTime": new_date.strftime( "%H:%M"), "endTime": (new_date + (to_date - from_date)).strftime( "%H:%M"), "suitable": suitable, "reason": response["reason"]}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail= "Issue finding new time " + str(e) + "response: " + str(completion.choices[0].message.content))
-        
+    alternative_times.sort()
+    suitable = False
+    response = {"reason": "No alternative time with a suitable forecast was found."}
+    if not alternative_times:
+        return {"startTime": from_date.strftime( "%H:%M"), "endTime": to_date.strftime( "%H:%M"), "suitable": suitable, "reason": response["reason"]}
+    # Fetch the forecast for all alternative times at once and check weather suitability for each of them
+    series = await get_weather_series(task_dict["latitude"], task_dict["longitude"], min(alternative_times), max(alternative_times) + timedelta(hours=1), task_dict["description"], activity=task_dict["activity"])
+    candidates = zip(alternative_times, weather_at_many(series, alternative_times))
+    candidates = [(new_date, weather_data) for new_date, weather_data in candidates if weather_data is not None]
+    try:
+        new_date, response = await find_first_suitable(task_dict, candidates)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail= "Issue finding new time " + str(e))
+    if new_date is not None:
+        return {"startTime": new_date.strftime( "%H:%M"), "endTime": (new_date + (to_date - from_date)).strftime( "%H:%M"), "suitable": True, "reason": response["reason"]}
 
     return {"startTime": from_date.strftime( "%H:%M"), "endTime": to_date.strftime( "%H:%M"), "suitable": suitable, "reason": response["reason"]}
 
- 
+
+async def find_first_suitable(task: dict, candidates: list):
+    """
+    Checks the weather of the candidate slots concurrently, at most NEW_TIME_CONCURRENCY at a time.
+
+    candidates is a chronologically sorted list of (start, weather_data). The candidates are awaited in order,
+    so the earliest suitable slot wins even if a later one finishes first; all outstanding checks are cancelled
+    as soon as it is known.
+
+    Returns (start, response) of the earliest suitable slot, or (None, response of the last slot).
+    """
+    response = {"reason": "No alternative time with a suitable forecast was found."}
+    semaphore = asyncio.Semaphore(NEW_TIME_CONCURRENCY)
+
+    async def check(weather_data):
+        async with semaphore:
+            return await check_suitability(task, weather_data)
+
+    checks = [asyncio.ensure_future(check(weather_data)) for _, weather_data in candidates]
+    try:
+        for (new_date, _), pending in zip(candidates, checks):
+            response = await pending
+            if response["suitable"]:
+                return new_date, response
+        return None, response
+    finally:
+        for pending in checks:
+            pending.cancel()
+        await asyncio.gather(*checks, return_exceptions=True)
+
 
 # Main for running with Uvicorn
 if __name__ == "__main__":
@@ -1,23 +1,17 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Union, List, Optional 
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
+from typing import ClassVar, Union, List, Optional 
+from contextlib import asynccontextmanager
 import json
 from datetime import datetime
 
+import llm
 import mongo_calls as db
+from validation import CheckedTask, first_invalid_key
 
 unique_id = 5
 
-# Load environment variables
-# Your key needs to be in the .env file in the root of the project, like this: OPENAI_API_KEY='<your key>'
-load_dotenv()
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
 model = "gpt-4-1106-preview"
 
 
@@ -49,7 +43,15 @@ optimal_task = {
 }
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.connect()
+    yield
+    db.close()
+    await llm.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Set up CORS middleware
 app.add_middleware(
@@ -102,24 +104,25 @@ class UpdateTaskRequest(BaseModel):
     task: Task
     text: str
     
-def automatated_comparator(predicted_dict : dict, optimal_dict : dict):
-    pred = json.dumps(predicted_dict)
-    opt = json.dumps(optimal_dict)
-    try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": f"You take the role of an answer validator. You receive an dictionary that was generated by an AI and you need to compare it to a dictionary that has the correct format. You decide wether the AI's output is correct or not. If it is correct, you will output yes, otherwise you will write the key of the first value that is incorrect and the reason why it is wrong. The output is considered to be correct if and only if all values are provided and they have the same type as the well-formated dictionary. You will not produce any other output other that 'yes' or the keyname + reason why it is wrong. Also explicity state in your reason the incorrect value"},
-                {"role": "user", "content": f"AI-generated dictionary: {pred}"},
-                {"role": "user", "content": f"Well-formated dictionary: {opt}"}
-            ]
-        )
-        if completion.choices[0].message.content == "yes":
-            return True, ""
-        else:
-            return False, completion.choices[0].message.content
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+class CheckedTempTask(CheckedTask):
+    """
+    A completely and correctly filled task of this API, which uses dd/mm/yyyy dates and "sheltered" instead of "indoor".
+    """
+    date_format: ClassVar[str] = "%d/%m/%Y"
+
+    indoor: Optional[bool] = None
+    sheltered: bool
+
+
+def automatated_comparator(predicted_dict : dict):
+    """
+    Checks locally that every entry of the extracted task is filled in with a value of the right format.
+    Returns (True, "") or (False, "<first invalid key> <reason>").
+    """
+    invalid = first_invalid_key(predicted_dict, CheckedTempTask)
+    if invalid is None:
+        return True, ""
+    return False, f"{invalid[0]} {invalid[1]}"
     
 def fix_bool_value(json_dict : dict):
     if not isinstance(json_dict.get("sheltered"), bool):
@@ -202,9 +205,10 @@ async def analyze_text(text_request: TextRequest):
     global unique_id
     unique_id += 1
     try:
-        completion = client.chat.completions.create(
+        completion_message_content = await llm.complete(
             model=model,
             response_format={ "type": "json_object" },
+            cache=True,
             messages=[
                 {"role": "system", "content": f"You are an assistant that extracts information from text. You receive as input a text and you will extract information from it and fill out a template based on it. You return nothing other than the filled-out template in valid json format. If you are unsure about any value, fill in your best guess. Make sure to fill in every single value and return valid json. Today is {datetime.now().strftime('%Y-%m-%d')}."},
                 {"role": "user", "content": f"{text_request.text}"},
@@ -213,10 +217,9 @@ async def analyze_text(text_request: TextRequest):
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    completion_message_content = completion.choices[0].message.content
     extracted_json = json.loads(completion_message_content)
     
-    res, key = automatated_comparator(extracted_json, optimal_task)
+    res, key = automatated_comparator(extracted_json)
     if res:
         return {
             "correct": True,
@@ -241,9 +244,10 @@ async def update_task(update_request: UpdateTaskRequest):
     
 
     try:
-        completion = client.chat.completions.create(
+        completion_message_content = await llm.complete(
             model=model,
             response_format={ "type": "json_object" },
+            cache=True,
             messages=[
                 {"role": "system", "content": f"You are an assistant that updates a dictionary based on information extracted from a text. You receive a dictionary and a text, and you will update the task with the information extracted from the text. You return the updated task in valid json format. Make sure to only update the values that you can extract from the text and to keep the rest of the values the same. Also, only return the dictionary and nothing else in the same format that you received it."},
                 {"role": "user", "content": f"Dictionary: {task}"},
@@ -254,10 +258,9 @@ async def update_task(update_request: UpdateTaskRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    completion_message_content = completion.choices[0].message.content
     extracted_json = json.loads(completion_message_content)
     
-    res, key = automatated_comparator(extracted_json, optimal_task)
+    res, key = automatated_comparator(extracted_json)
     if res:
         return {
             "correct": True,
@@ -295,8 +298,9 @@ async def propose_new_date(old_text: dict, new_proposed_date: dict):
     old_str = json.dumps(old_text)
     new_str = json.dumps(new_proposed_date)
     try:
-        completion = client.chat.completions.create(
+        completion_message_content = await llm.complete(
             model=model,
+            cache=True,
             messages=[
                 {"role": "system", "content": f"You are an automated system that formulates a rescheduling because the weather is bad during the original activity plan. Based on input information for an event and a new proposed time, you will write a short text where you propose the new time for the activity. An example might be: 'Due to rain during this time, you might want to reschedule your meeting for tomorrow'. Today is {datetime.now().strftime('%Y-%m-%d')}."},
                 {"role": "user", "content": f"Activity: {old_str}"},
@@ -305,7 +309,6 @@ async def propose_new_date(old_text: dict, new_proposed_date: dict):
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    completion_message_content = completion.choices[0].message.content
     return {"result": completion_message_content}
 
 
@@ -0,0 +1,96 @@
+import json
+import sys
+
+import httpx
+import numpy as np
+
+# Columnar decoder for the CoverageJSON documents returned by EDR /position queries.
+# Uses orjson to parse the response when it is installed.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Time axis of a coverage without a "t" axis: a single step of unknown time
+NO_TIME = np.array(["NaT"], dtype="datetime64[s]")
+
+
+def loads(content: bytes):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def read_response(response):
+    """
+    Parses the body of a response, with orjson if it is installed. Other objects than httpx responses
+    (e.g. stand-ins in tests) are read with their json() method.
+    """
+    if orjson is not None and isinstance(response, httpx.Response):
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def parse_times(dates) -> np.ndarray:
+    """
+    Parses a list of "%Y-%m-%dT%H:%M:%SZ" timestamps into a datetime64 array in one call.
+    """
+    return np.array([date.rstrip("Z") for date in dates], dtype="datetime64[s]")
+
+
+def first_value(axis: dict):
+    if "values" in axis:
+        return axis["values"][0]
+    return axis.get("start")
+
+
+def decode(data: dict) -> dict:
+    """
+    Decodes a CoverageJSON coverage collection (or a single coverage) into columns:
+    {
+        "time": datetime64 array of all time steps, sorted,
+        "points": [(x, y), ...] in order of appearance,
+        "parameters": {parameter: {"unit": "", "description": "", "values": float array of shape (points, time)}}
+    }
+    Values that are missing in the document are NaN. Units and descriptions are interned, they repeat for every point.
+    A coverage without a time axis counts as one step of unknown time (NaT), sorted after all known steps.
+    """
+    coverages = data.get("coverages", [data])
+    info = data.get("parameters", {})
+    points = {}
+    entries = []
+    for coverage in coverages:
+        axes = coverage.get("domain", {}).get("axes", {})
+        point = (first_value(axes["x"]), first_value(axes["y"])) if "x" in axes and "y" in axes else (None, None)
+        point_index = points.setdefault(point, len(points))
+        times = parse_times(axes["t"]["values"]) if "t" in axes else NO_TIME
+        for param, param_range in coverage["ranges"].items():
+            values = np.asarray(param_range["values"], dtype=float).reshape(len(times), -1)[:, 0]
+            entries.append((param, point_index, times, values))
+    time = np.unique(np.concatenate([times for _, _, times, _ in entries])) if entries else np.array([], dtype="datetime64[s]")
+
+    parameters = {}
+    for param, point_index, times, values in entries:
+        column = parameters.get(param)
+        if column is None:
+            param_info = info.get(param, {})
+            column = parameters[param] = {
+                "unit": intern(param_info.get("unit", {}).get("symbol")),
+                "description": intern(param_info.get("observedProperty", {}).get("label", {}).get("en")),
+                "values": np.full((len(points), len(time)), np.nan),
+            }
+        column["values"][point_index, np.searchsorted(time, times)] = values
+    return {"time": time, "points": list(points), "parameters": parameters}
+
+
+def to_list(values: np.ndarray) -> list:
+    """
+    Converts a column to a list of floats, with None for missing values.
+    """
+    return np.where(np.isnan(values), None, values).tolist()
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import httpx
+
+# Async, connection-pooled client for the IBL OGC EDR API (climathon.iblsoft.com).
+# One client is shared by all requests of a worker so that TCP+TLS connections are kept alive and reused.
+
+EDR_TIMEOUT = float(os.environ.get("EDR_TIMEOUT", "10"))
+EDR_CONNECT_TIMEOUT = float(os.environ.get("EDR_CONNECT_TIMEOUT", "5"))
+EDR_MAX_CONNECTIONS = int(os.environ.get("EDR_MAX_CONNECTIONS", "20"))
+EDR_MAX_KEEPALIVE = int(os.environ.get("EDR_MAX_KEEPALIVE", "10"))
+EDR_RETRIES = int(os.environ.get("EDR_RETRIES", "2"))
+EDR_RETRY_BACKOFF = float(os.environ.get("EDR_RETRY_BACKOFF", "0.5"))
+
+# Status codes that are worth another attempt
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+headers = {
+    "accept": "application/json"
+}
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    global client
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers=headers,
+            http2=HTTP2,
+            timeout=httpx.Timeout(EDR_TIMEOUT, connect=EDR_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=EDR_MAX_CONNECTIONS, max_keepalive_connections=EDR_MAX_KEEPALIVE),
+        )
+    return client
+
+
+async def get(url: str, params: dict = None, headers: dict = None) -> httpx.Response:
+    """
+    Sends a GET request over the shared client.
+
+    Connection errors, timeouts and the status codes in RETRY_STATUS_CODES are retried up to EDR_RETRIES times
+    with exponential backoff. The last response is returned as is, the caller checks the status code.
+    """
+    attempt = 0
+    while True:
+        try:
+            response = await get_client().get(url, params=params, headers=headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt >= EDR_RETRIES:
+                return response
+        except httpx.TransportError:
+            if attempt >= EDR_RETRIES:
+                raise
+        await asyncio.sleep(EDR_RETRY_BACKOFF * (2 ** attempt))
+        attempt += 1
+
+
+async def close():
+    global client
+    if client is not None:
+        await client.aclose()
+        client = None
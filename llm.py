@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+
+from cache import TTLCache
+from singleflight import SingleFlight
+
+# Shared completion layer for api.py, api2.py and weather.py.
+# Your key needs to be in the .env file in the root of the project, like this: OPENAI_API_KEY='<your key>'
+load_dotenv()
+
+# Maximum number of completions in flight per worker, and seconds before a single completion is abandoned
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "2"))
+
+# Cache of completions requested with cache=True, see complete()
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "86400"))
+# Where cached completions survive restarts: "memory" (they do not), "disk" or "mongo"
+LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", ".llm_cache")
+
+client = None
+semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+
+def get_client():
+    global client
+    if client is None:
+        client = AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            timeout=LLM_TIMEOUT,
+            max_retries=LLM_MAX_RETRIES,
+        )
+    return client
+
+
+class DiskCompletionStore:
+    """
+    Keeps cached completions as one json file per key in a directory.
+    Expired files are deleted when they are read, and the oldest files when there are more than max_size.
+    """
+
+    def __init__(self, directory: str, max_size: int = LLM_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".json")
+
+    def read(self, key: str) -> Optional[str]:
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires"] < time.time():
+            self.remove(self.path(key))
+            return None
+        return entry["content"]
+
+    def write(self, key: str, content: str, ttl: float):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path(key) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"content": content, "expires": time.time() + ttl}, f)
+        os.replace(tmp_path, self.path(key))
+        self.trim()
+
+    def trim(self):
+        with os.scandir(self.directory) as entries:
+            files = [entry for entry in entries if entry.name.endswith(".json")]
+        if len(files) <= self.max_size:
+            return
+        files.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in files[:len(files) - self.max_size]:
+            self.remove(entry.path)
+
+    @staticmethod
+    def remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    async def get(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self.read, key)
+
+    async def set(self, key: str, content: str, ttl: float):
+        await asyncio.to_thread(self.write, key, content, ttl)
+
+
+class MongoCompletionStore:
+    """
+    Keeps cached completions in the LLMCache collection of the task database, expired by a TTL index.
+    """
+
+    def __init__(self):
+        self.indexed = False
+
+    async def collection(self):
+        import mongo_calls as db
+        collection = db.get_client().TaskDatabase["LLMCache"]
+        if not self.indexed:
+            await collection.create_index("expiresAt", expireAfterSeconds=0)
+            self.indexed = True
+        return collection
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = await (await self.collection()).find_one({"_id": key, "expiresAt": {"$gt": datetime.utcnow()}})
+        return entry["content"] if entry is not None else None
+
+    async def set(self, key: str, content: str, ttl: float):
+        await (await self.collection()).replace_one(
+            {"_id": key},
+            {"_id": key, "content": content, "expiresAt": datetime.utcnow() + timedelta(seconds=ttl)},
+            upsert=True,
+        )
+
+
+completion_cache = TTLCache(LLM_CACHE_SIZE, LLM_CACHE_TTL)
+completion_store = {"disk": lambda: DiskCompletionStore(LLM_CACHE_DIR), "mongo": MongoCompletionStore}.get(LLM_CACHE_BACKEND, lambda: None)()
+cache_stats = {"store_hits": 0, "bytes_saved": 0}
+# Cacheable completions in progress, keyed by cache_key
+completion_flights = SingleFlight()
+
+
+def cache_key(model: str, messages: List[dict], response_format: Optional[dict]) -> str:
+    data = json.dumps({"model": model, "messages": messages, "response_format": response_format}, sort_keys=True)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+async def get_cached(key: str) -> Optional[str]:
+    content = completion_cache.get(key)
+    if content is None and completion_store is not None:
+        try:
+            content = await completion_store.get(key)
+        except Exception as e:
+            print(f"Completion cache store failed: {e}")
+        if content is not None:
+            cache_stats["store_hits"] += 1
+            completion_cache.set(key, content)
+    if content is not None:
+        cache_stats["bytes_saved"] += len(content.encode())
+    return content
+
+
+async def set_cached(key: str, content: str):
+    completion_cache.set(key, content)
+    if completion_store is not None:
+        try:
+            await completion_store.set(key, content, LLM_CACHE_TTL)
+        except Exception as e:
+            print(f"Completion cache store failed: {e}")
+
+
+def get_cache_stats() -> dict:
+    return {**completion_cache.stats(), **cache_stats, "backend": LLM_CACHE_BACKEND, "single_flight": completion_flights.stats()}
+
+
+async def complete_cached(key: str, model: str, messages: List[dict], response_format: Optional[dict], timeout: Optional[float]) -> str:
+    content = await get_cached(key)
+    if content is None:
+        content = await complete(model, messages, response_format, timeout)
+        await set_cached(key, content)
+    return content
+
+
+async def complete(model: str, messages: List[dict], response_format: Optional[dict] = None, timeout: Optional[float] = None, cache: bool = False) -> str:
+    """
+    Runs one chat completion without blocking the event loop and returns the content of the first choice.
+
+    At most LLM_MAX_CONCURRENCY completions run at the same time, the rest wait for a free slot.
+    The timeout (in seconds) applies to the upstream call only, not to the time spent waiting for a slot.
+
+    With cache=True the answer is cached under a hash of (model, messages, response_format). Only use it for
+    prompts whose answer may be reused, e.g. because the prompt fully determines it. Identical cacheable
+    prompts that are sent while the first one is still running share its completion.
+    """
+    if cache:
+        key = cache_key(model, messages, response_format)
+        return await completion_flights.do(key, complete_cached, key, model, messages, response_format, timeout)
+    kwargs = {}
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+    async with semaphore:
+        completion = await get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            timeout=timeout if timeout is not None else LLM_TIMEOUT,
+            **kwargs
+        )
+    return completion.choices[0].message.content
+
+
+async def stream_complete(model: str, messages: List[dict], timeout: Optional[float] = None):
+    """
+    Runs one chat completion as a stream and yields the content of the first choice piece by piece, as it is generated.
+    Holds one of the LLM_MAX_CONCURRENCY slots until the stream is finished or closed.
+    """
+    async with semaphore:
+        stream = await get_client().chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            timeout=timeout if timeout is not None else LLM_TIMEOUT,
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+async def close():
+    global client
+    if client is not None:
+        await client.close()
+        client = None
@@ -1,11 +1,47 @@
 import asyncio
-from typing import List
+import base64
+import json
+import re
+from typing import List, Optional, Tuple
+from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, ReplaceOne, ReturnDocument
+from pymongo.errors import BulkWriteError, PyMongoError
 from pymongo.server_api import ServerApi
 import os
 
+# Connection pool of the shared client
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.environ.get("MONGO_MIN_POOL_SIZE", "5"))
 
-def get_client():
+# Page size of find_tasks when the caller gives none, and the largest page it hands out
+TASK_PAGE_SIZE = int(os.environ.get("TASK_PAGE_SIZE", "100"))
+TASK_MAX_PAGE_SIZE = int(os.environ.get("TASK_MAX_PAGE_SIZE", "1000"))
+
+# Sort orders of find_tasks, _id makes them unique so they can be used as pagination cursors
+TASK_SORTS = {
+    "taskID": ["taskID", "_id"],
+    "date": ["date", "startTime", "_id"],
+}
+
+# Documents fetched per round trip when streaming an export
+TASK_EXPORT_BATCH_SIZE = int(os.environ.get("TASK_EXPORT_BATCH_SIZE", "500"))
+
+# Tasks sent per bulk_write by bulk_upsert_tasks
+TASK_BULK_CHUNK_SIZE = int(os.environ.get("TASK_BULK_CHUNK_SIZE", "1000"))
+
+# Tasks of requests without a user go to this collection
+DEFAULT_USERNAME = "jpassweg"
+# Usernames are used as collection names
+USERNAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Collections of the task database that do not belong to a user
+SYSTEM_COLLECTIONS = {"LLMCache"}
+
+# One client per process, created by connect() at startup (or lazily on first use) and closed by close()
+client = None
+
+
+def create_client():
     password = os.environ.get("MONGO_DB_KEY")
 
     if password is None:
@@ -16,8 +52,18 @@ def get_client():
     uri = "mongodb+srv://" + "jpassweg" + ":" + password + uri_post
 
     # Set the Stable API version when creating a new client
-    client = AsyncIOMotorClient(uri, server_api=ServerApi('1'))
-    
+    return AsyncIOMotorClient(
+        uri,
+        server_api=ServerApi('1'),
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+    )
+
+
+def get_client():
+    global client
+    if client is None:
+        client = create_client()
     return client
 
 
@@ -27,6 +73,100 @@ def get_task_collection(username : str):
     return task_collection
 
 
+async def connect():
+    """
+    Creates the shared client and warms up the connection pool, so the first request does not pay
+    for the SRV lookup, TLS handshake and server discovery.
+    """
+    try:
+        get_client()
+    except Exception as e:
+        print(e)
+        return
+    await ping_server()
+    try:
+        await get_user_collection(DEFAULT_USERNAME)
+    except Exception as e:
+        print(e)
+
+
+async def ensure_indexes(task_collection):
+    """
+    Creates the indexes the data-access functions rely on. Creating an existing index is a no-op.
+    """
+    # Documents stored before taskID was written have no taskID, they are left out of the unique index
+    await task_collection.create_index(
+        "taskID",
+        unique=True,
+        partialFilterExpression={"taskID": {"$exists": True}},
+    )
+    # Backing indexes of the sort orders and filters of find_tasks
+    await task_collection.create_index([("taskID", 1), ("_id", 1)])
+    await task_collection.create_index([("date", 1), ("startTime", 1), ("_id", 1)])
+    # equality filter first, then the default taskID keyset sort, so filtered pages are read in index order
+    await task_collection.create_index([("activity", 1), ("taskID", 1), ("_id", 1)])
+    await task_collection.create_index([("indoor", 1), ("taskID", 1), ("_id", 1)])
+
+
+# Collection handles whose indexes are ensured: username -> collection, see get_user_collection
+collections = {}
+# Index setups in progress, so concurrent first requests of a user share one
+index_setups = {}
+
+
+def valid_username(username: str) -> bool:
+    return USERNAME_PATTERN.match(username) is not None and username not in SYSTEM_COLLECTIONS
+
+
+async def list_usernames() -> List[str]:
+    """
+    Returns the users that have a task collection.
+    """
+    names = await get_client().TaskDatabase.list_collection_names()
+    return sorted(name for name in names if valid_username(name))
+
+
+async def get_user_collection(username: str):
+    """
+    Returns the task collection of a user. The first call per user and process creates the indexes,
+    all later calls are a dictionary lookup.
+    Raises ValueError if the username is not a valid collection name.
+    """
+    task_collection = collections.get(username)
+    if task_collection is not None:
+        return task_collection
+    if not valid_username(username):
+        raise ValueError(f"Invalid username {username}")
+    setup = index_setups.get(username)
+    if setup is None:
+        setup = asyncio.ensure_future(ensure_indexes(get_task_collection(username)))
+        index_setups[username] = setup
+    try:
+        await asyncio.shield(setup)
+    finally:
+        if index_setups.get(username) is setup and setup.done():
+            del index_setups[username]
+    collections[username] = get_task_collection(username)
+    return collections[username]
+
+
+def with_task_id(task_data: dict) -> dict:
+    """
+    The API model calls the id taskId, the collection is keyed on taskID. Copies the one into the other.
+    """
+    if task_data.get("taskID") is None and task_data.get("taskId") is not None:
+        task_data = {**task_data, "taskID": task_data["taskId"]}
+    return task_data
+
+
+def close():
+    global client
+    collections.clear()
+    if client is not None:
+        client.close()
+        client = None
+
+
 async def ping_server():
     # Send a ping to confirm a successful connection
     try:
@@ -37,49 +177,197 @@ async def ping_server():
         print(e)
     
 
-async def add_task(task_data: dict) -> dict:
-    task_collection = get_task_collection("jpassweg")
-    task = await task_collection.insert_one(task_data)
+async def add_task(task_data: dict, username: str = DEFAULT_USERNAME) -> dict:
+    task_collection = await get_user_collection(username)
+    task = await task_collection.insert_one(with_task_id(task_data))
     print("result %s" % repr(task.inserted_id))
     new_task = await task_collection.find_one({"_id": task.inserted_id})
     return new_task
 
 
-async def add_multiple_tasks(task_data: List [dict]) -> bool:
-    task_collection = get_task_collection("jpassweg")
+async def add_multiple_tasks(task_data: List [dict], username: str = DEFAULT_USERNAME) -> bool:
+    task_collection = await get_user_collection(username)
     task = await task_collection.insert_many(task_data)
     return task is not None
 
 
-async def retrieve_tasks() -> List[dict]:
-    task_collection = get_task_collection("jpassweg")
+async def bulk_upsert_tasks(task_data: List[dict], chunk_size: Optional[int] = None, username: str = DEFAULT_USERNAME) -> List[dict]:
+    """
+    Writes many tasks with unordered bulk writes of chunk_size tasks each.
+    Tasks with a taskID replace the stored task with that id or are inserted, tasks without one are inserted.
+
+    Returns one status per task, in input order: {"status": "inserted" | "updated" | "failed", "error": str}.
+    A failing task does not stop the others.
+    """
+    chunk_size = chunk_size or TASK_BULK_CHUNK_SIZE
+    task_collection = await get_user_collection(username)
+    statuses = []
+    for start in range(0, len(task_data), chunk_size):
+        chunk = [with_task_id(task) for task in task_data[start:start + chunk_size]]
+        operations = [
+            ReplaceOne({"taskID": task["taskID"]}, task, upsert=True) if task.get("taskID") is not None else InsertOne(task)
+            for task in chunk
+        ]
+        upserted, errors = set(), {}
+        try:
+            result = await task_collection.bulk_write(operations, ordered=False)
+            upserted = set(result.upserted_ids)
+        except BulkWriteError as e:
+            upserted = {item["index"] for item in e.details.get("upserted", [])}
+            errors = {item["index"]: item.get("errmsg", "write error") for item in e.details.get("writeErrors", [])}
+        except PyMongoError as e:
+            # the outcome of the chunk is unknown, report all of its tasks as failed so they can be sent again
+            errors = {index: str(e) for index in range(len(operations))}
+        for index, operation in enumerate(operations):
+            if index in errors:
+                statuses.append({"status": "failed", "error": errors[index]})
+            elif isinstance(operation, InsertOne) or index in upserted:
+                statuses.append({"status": "inserted"})
+            else:
+                statuses.append({"status": "updated"})
+    return statuses
+
+
+async def retrieve_tasks(username: str = DEFAULT_USERNAME) -> List[dict]:
+    task_collection = await get_user_collection(username)
     tasks = []
     async for task_data in task_collection.find():
         tasks.append(task_data)
     return tasks
 
 
-async def update_task(task_data : dict) -> bool:
-    task_collection = get_task_collection("jpassweg")
-    coll = task_collection
-    n = await coll.count_documents({})
-    result = await task_collection.delete_one({"taskID" : task_data["taskID"]})
-    task = await task_collection.insert_one(task_data)
-    print("result %s" % repr(task.inserted_id))
-    new_task = await task_collection.find_one({"_id": task.inserted_id})
-    return new_task is not None and result.deleted_count > 0
-    
-    
+def task_filter(date_from: Optional[str] = None, date_to: Optional[str] = None, activity: Optional[str] = None, indoor: Optional[bool] = None) -> dict:
+    """
+    Builds the query for tasks between date_from and date_to (inclusive, yyyy-mm-dd), of an activity and/or indoor flag.
+    """
+    query = {}
+    if date_from is not None or date_to is not None:
+        query["date"] = {}
+        if date_from is not None:
+            query["date"]["$gte"] = date_from
+        if date_to is not None:
+            query["date"]["$lte"] = date_to
+    if activity is not None:
+        query["activity"] = activity
+    if indoor is not None:
+        query["indoor"] = indoor
+    return query
+
+
+def encode_cursor(task_data: dict, keys: List[str]) -> str:
+    values = [str(task_data["_id"]) if key == "_id" else task_data.get(key) for key in keys]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, keys: List[str]) -> dict:
+    """
+    Returns the query for all tasks that come after the cursor in the sort order of keys.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        values = [ObjectId(value) if key == "_id" else value for key, value in zip(keys, values)]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if len(values) != len(keys):
+        raise ValueError("Invalid cursor")
+    clauses = []
+    for i, key in enumerate(keys):
+        clause = dict(zip(keys[:i], values[:i]))
+        # missing values sort first, everything that is set comes after them
+        clause[key] = {"$ne": None} if values[i] is None else {"$gt": values[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+
+async def find_tasks(limit: Optional[int] = None, cursor: Optional[str] = None, sort: str = "taskID", fields: Optional[List[str]] = None, username: str = DEFAULT_USERNAME, **filters) -> Tuple[List[dict], Optional[str]]:
+    """
+    Returns one page of tasks and the cursor of the next page (None on the last page).
+
+    The filters are the arguments of task_filter. fields limits the returned keys of each task.
+    Raises ValueError on an unknown sort order or an invalid cursor.
+    """
+    if sort not in TASK_SORTS:
+        raise ValueError(f"Unknown sort order {sort}")
+    keys = TASK_SORTS[sort]
+    limit = min(limit or TASK_PAGE_SIZE, TASK_MAX_PAGE_SIZE)
+    query = task_filter(**filters)
+    if cursor is not None:
+        query = {"$and": [query, decode_cursor(cursor, keys)]}
+    projection = None
+    if fields:
+        # the sort keys are needed for the next cursor
+        projection = {field: 1 for field in list(fields) + keys}
+    task_collection = await get_user_collection(username)
+    tasks = await task_collection.find(query, projection).sort([(key, 1) for key in keys]).limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(tasks[limit - 1], keys) if len(tasks) > limit else None
+    tasks = tasks[:limit]
+    for task_data in tasks:
+        del task_data["_id"]
+        if fields:
+            for key in keys:
+                if key not in fields:
+                    task_data.pop(key, None)
+    return tasks, next_cursor
+
+
+async def stream_tasks(batch_size: Optional[int] = None, sort: str = "taskID", username: str = DEFAULT_USERNAME, **filters):
+    """
+    Yields the tasks matching the filters of task_filter one by one, straight from the cursor,
+    fetching batch_size documents per round trip.
+    """
+    if sort not in TASK_SORTS:
+        raise ValueError(f"Unknown sort order {sort}")
+    task_collection = await get_user_collection(username)
+    cursor = task_collection.find(task_filter(**filters), {"_id": 0}).sort([(key, 1) for key in TASK_SORTS[sort] if key != "_id"])
+    cursor = cursor.batch_size(batch_size or TASK_EXPORT_BATCH_SIZE)
+    async for task_data in cursor:
+        yield task_data
+
+
+async def update_task(task_data : dict, upsert: bool = False, username: str = DEFAULT_USERNAME) -> bool:
+    """
+    Replaces the task with the same taskID in one indexed round trip.
+    With upsert the task is inserted if it does not exist yet.
+    """
+    task_collection = await get_user_collection(username)
+    replacement = {key: value for key, value in with_task_id(task_data).items() if key != "_id"}
+    if replacement.get("taskID") is None:
+        return False
+    new_task = await task_collection.find_one_and_replace(
+        {"taskID": replacement["taskID"]},
+        replacement,
+        projection={"_id": 1},
+        upsert=upsert,
+        return_document=ReturnDocument.AFTER,
+    )
+    return new_task is not None
+
+
+async def find_task(id : int, fields: Optional[List[str]] = None, username: str = DEFAULT_USERNAME) -> Optional[dict]:
+    """
+    Returns the task with the given taskID, limited to fields if given, or None if there is none.
+    """
+    task_collection = await get_user_collection(username)
+    projection = {"_id": 0, **{field: 1 for field in fields or []}}
+    return await task_collection.find_one({"taskID": id}, projection)
+
+
+async def set_task_weather(id : int, weather: dict, username: str = DEFAULT_USERNAME) -> bool:
+    """
+    Stores the weather verdict of a task in its weather entry, without touching the rest of the task.
+    """
+    task_collection = await get_user_collection(username)
+    result = await task_collection.update_one({"taskID": id}, {"$set": {"weather": weather}})
+    return result.matched_count > 0
+
+
+async def delete_task(id : int, username: str = DEFAULT_USERNAME) -> bool:
+    task_collection = await get_user_collection(username)
+    deleted_task = await task_collection.find_one_and_delete({"taskID" : id}, projection={"_id": 1})
+    return deleted_task is not None
 
-async def delete_task(id : int) -> bool:
-    task_collection = get_task_collection("jpassweg")
-    coll = task_collection
-    n = await coll.count_documents({})
-    result = await task_collection.delete_one({"taskID" : id})
-    return result.deleted_count > 0
-    
 
-async def print_all():
-    tasks = await retrieve_tasks()
+async def print_all(username: str = DEFAULT_USERNAME):
+    tasks = await retrieve_tasks(username)
     for task in tasks:
         print(task)
\ No newline at end of file
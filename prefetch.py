@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+import mongo_calls as db
+import suitability
+import weather
+
+# Background job of the API worker: checks the weather of all upcoming outdoor tasks of every user
+# whenever a new GFS run is published, and stores the verdict on the task, so /weather can read it.
+# A stored verdict is {"suitable", "reason", "run", "inputHash", "checkedAt"}; it is valid as long as
+# the forecast run and the hash of the task entries it was made for are unchanged.
+
+# Every worker that has the prefetcher enabled scans all users, so enable it in one worker (or process) only
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "false").lower() in ("1", "true", "yes")
+# Seconds between two scans of the stored tasks, 0 turns the prefetcher off
+PREFETCH_INTERVAL = float(os.environ.get("PREFETCH_INTERVAL", "600"))
+# Only tasks that start within this many hours are checked
+PREFETCH_HORIZON_HOURS = float(os.environ.get("PREFETCH_HORIZON_HOURS", "96"))
+# Grid cells fetched at the same time
+PREFETCH_CONCURRENCY = int(os.environ.get("PREFETCH_CONCURRENCY", "4"))
+
+# Entries of a task that its weather verdict depends on
+WEATHER_INPUT_KEYS = ("date", "startTime", "endTime", "activity", "description", "latitude", "longitude", "indoor")
+
+prefetch_stats = {"scans": 0, "tasks": 0, "cells": 0, "verdicts": 0, "undecided": 0, "errors": 0, "rechecks": 0}
+# Rechecks of edited tasks in progress, kept so they are not garbage collected
+rechecks = set()
+
+
+def task_times(task: dict) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Returns (start, end) of a task, or None if its date or times cannot be read.
+    """
+    try:
+        start = datetime.strptime(f'{task["date"]} {task["startTime"]}', "%Y-%m-%d %H:%M")
+        end = datetime.strptime(f'{task["date"]} {task["endTime"]}', "%Y-%m-%d %H:%M")
+    except (KeyError, TypeError, ValueError):
+        return None
+    return start, end
+
+
+def collection_url(task: dict) -> str:
+    start, end = task_times(task)
+    return weather.get_collections(abs(end - start))[0]
+
+
+def run_id(run: Optional[datetime]) -> Optional[str]:
+    return run.strftime("%Y-%m-%dT%H:%M:%SZ") if run is not None else None
+
+
+def input_hash(task: dict) -> str:
+    data = json.dumps([task.get(key) for key in WEATHER_INPUT_KEYS], default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def make_verdict(task: dict, suitable: bool, reason: str, run: Optional[datetime]) -> dict:
+    return {
+        "suitable": suitable,
+        "reason": reason,
+        "run": run_id(run),
+        "inputHash": input_hash(task),
+        "checkedAt": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def is_fresh(task: dict, verdict: Optional[dict], run: Optional[datetime]) -> bool:
+    """
+    Whether a stored verdict was made for the same task entries and forecast run.
+    """
+    if not verdict or run is None:
+        return False
+    return verdict.get("run") == run_id(run) and verdict.get("inputHash") == input_hash(task)
+
+
+async def stored_verdict(task: dict, username: str = db.DEFAULT_USERNAME) -> Optional[dict]:
+    """
+    Returns {"suitable", "reason"} stored for a task if it is still valid, otherwise None.
+    """
+    if task.get("taskId") is None or task_times(task) is None:
+        return None
+    stored = await db.find_task(task["taskId"], ["weather"], username)
+    if not stored or not stored.get("weather"):
+        return None
+    url = collection_url(task)
+    await weather.get_temporal_extent(url)
+    if not is_fresh(task, stored["weather"], weather.forecast_run(url)):
+        return None
+    return {"suitable": stored["weather"]["suitable"], "reason": stored["weather"]["reason"]}
+
+
+async def store_verdict(task: dict, suitable: bool, reason: str, username: str = db.DEFAULT_USERNAME) -> bool:
+    """
+    Stores a verdict made outside of the prefetcher (e.g. by /weather) on the stored task with the same taskId.
+    """
+    if task.get("taskId") is None or task_times(task) is None:
+        return False
+    run = weather.forecast_run(collection_url(task))
+    return await db.set_task_weather(task["taskId"], make_verdict(task, suitable, reason, run), username)
+
+
+async def check_cell(tasks: list, username: str, semaphore: asyncio.Semaphore):
+    """
+    Fetches the forecast of one grid cell once, for all of its tasks, and stores the verdict of each task.
+    Tasks the rules cannot decide are left for /weather.
+    """
+    times = [task_times(task) for task in tasks]
+    start, end = times[0]
+    async with semaphore:
+        series = await weather.get_weather_series(
+            tasks[0]["latitude"], tasks[0]["longitude"],
+            min(t[0] for t in times), max(t[0] for t in times), "",
+            duration=abs(end - start), rules_only=True,
+        )
+    prefetch_stats["cells"] += 1
+    if series is None:
+        return
+    run = weather.forecast_run(collection_url(tasks[0]))
+    for task, (start, _) in zip(tasks, times):
+        suitable, reason = suitability.evaluate(task.get("activity"), weather.weather_at(series, start))
+        if suitable is None:
+            prefetch_stats["undecided"] += 1
+            continue
+        if await db.set_task_weather(task["taskID"], make_verdict(task, suitable, reason, run), username):
+            prefetch_stats["verdicts"] += 1
+
+
+async def scan_user(username: str, now: datetime, semaphore: asyncio.Semaphore):
+    """
+    Groups the upcoming outdoor tasks of a user without a valid verdict by collection and grid cell,
+    and checks every cell.
+    """
+    horizon = now + timedelta(hours=PREFETCH_HORIZON_HOURS)
+    cells = {}
+    async for task in db.stream_tasks(username=username, date_from=now.strftime("%Y-%m-%d"), date_to=horizon.strftime("%Y-%m-%d"), indoor=False):
+        times = task_times(task)
+        if task.get("taskID") is None or times is None or not now <= times[0] <= horizon:
+            continue
+        prefetch_stats["tasks"] += 1
+        url = collection_url(task)
+        if is_fresh(task, task.get("weather"), weather.forecast_run(url)):
+            continue
+        key = (url, weather.snap_to_grid(task["latitude"]), weather.snap_to_grid(task["longitude"]))
+        cells.setdefault(key, []).append(task)
+    await asyncio.gather(*(check_cell(tasks, username, semaphore) for tasks in cells.values()))
+
+
+def recheck(task: dict, username: str = db.DEFAULT_USERNAME):
+    """
+    Checks the weather of an edited task in the background, if it is an upcoming outdoor task.
+    Replacing a task drops its stored verdict, this stores a new one without waiting for the next scan.
+    """
+    task = db.with_task_id(task)
+    times = task_times(task)
+    now = datetime.now()
+    if task.get("taskID") is None or task.get("indoor") is not False or times is None:
+        return
+    if not now <= times[0] <= now + timedelta(hours=PREFETCH_HORIZON_HOURS):
+        return
+    prefetch_stats["rechecks"] += 1
+    recheck_task = asyncio.ensure_future(check_cell([task], username, asyncio.Semaphore(1)))
+    rechecks.add(recheck_task)
+    recheck_task.add_done_callback(finish_recheck)
+
+
+def finish_recheck(recheck_task: asyncio.Task):
+    rechecks.discard(recheck_task)
+    if not recheck_task.cancelled() and recheck_task.exception() is not None:
+        prefetch_stats["errors"] += 1
+        print(f"Recheck failed: {recheck_task.exception()}")
+
+
+async def scan():
+    """
+    Checks the upcoming outdoor tasks of all users. Tasks whose verdict was made with the current forecast run
+    are skipped, so every grid cell is fetched once per GFS run.
+    """
+    prefetch_stats["scans"] += 1
+    for url in (weather.SINGLE_LAYER_2, weather.SINGLE_LAYER_3):
+        await weather.get_temporal_extent(url)
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    now = datetime.now()
+    for username in await db.list_usernames():
+        await scan_user(username, now, semaphore)
+
+
+async def run_forever():
+    while True:
+        try:
+            await scan()
+        except Exception as e:
+            prefetch_stats["errors"] += 1
+            print(f"Prefetch failed: {e}")
+        await asyncio.sleep(PREFETCH_INTERVAL)
+
+
+def start() -> Optional[asyncio.Task]:
+    if not PREFETCH_ENABLED or PREFETCH_INTERVAL <= 0:
+        return None
+    return asyncio.ensure_future(run_forever())
+
+
+async def stop(prefetcher: Optional[asyncio.Task]):
+    if prefetcher is None:
+        return
+    prefetcher.cancel()
+    try:
+        await prefetcher
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,41 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Lets concurrent calls with the same key share one execution: the first caller starts it,
+    everyone who asks for the same key while it is running awaits the same result (or exception).
+
+    A waiter that is cancelled does not cancel the shared call. Nothing is kept after the call finishes,
+    caching the result is up to the function.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, function, *args, **kwargs):
+        self.calls += 1
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = asyncio.ensure_future(function(*args, **kwargs))
+            self.flights[key] = flight
+            flight.add_done_callback(lambda done: self.forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(flight)
+
+    def forget(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if not flight.cancelled():
+            # marks the exception as retrieved in case every waiter was cancelled
+            flight.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.flights),
+            "calls": self.calls,
+            "shared": self.shared,
+        }
@@ -0,0 +1,117 @@
+from typing import Optional, Tuple
+
+# Deterministic weather suitability rules over the EDR parameters of weather.py.
+# The rules answer most checks locally; only when they cannot decide the caller falls back to the LLM.
+
+ACTIVITIES = ("coffee", "drink", "eat", "meeting", "party", "running", "walking", "working", "other")
+
+# Parameter names without their aggregation period (/PT3H or /PT6H), so the rules work for both collections
+PRECIPITATION_RATE = "precipitation-rate_gnd-surf_stat:avg"
+CATEGORICAL_RAIN = "categorical-rain-yes-1-no-0_gnd-surf_stat:avg"
+CATEGORICAL_SNOW = "categorical-snow-yes-1-no-0_gnd-surf_stat:avg"
+CLOUD_COVER = "total-cloud-cover_atmosphere_stat:avg"
+MAXIMUM_TEMPERATURE = "maximum-temperature_stat:max"
+MINIMUM_TEMPERATURE = "minimum-temperature_stat:min"
+
+RULE_PARAMETERS = (PRECIPITATION_RATE, CATEGORICAL_RAIN, CATEGORICAL_SNOW, CLOUD_COVER, MAXIMUM_TEMPERATURE, MINIMUM_TEMPERATURE)
+
+# Precipitation in mm/h, cloud cover in %, temperatures in degrees Celsius.
+# rain/snow: whether the activity still works when the categorical rain/snow flag is set.
+ACTIVITY_THRESHOLDS = {
+    "coffee": {"max_precipitation": 0.1, "rain": False, "snow": False, "max_cloud_cover": 100, "min_temperature": 12, "max_temperature": 33},
+    "drink": {"max_precipitation": 0.1, "rain": False, "snow": False, "max_cloud_cover": 100, "min_temperature": 12, "max_temperature": 33},
+    "eat": {"max_precipitation": 0.1, "rain": False, "snow": False, "max_cloud_cover": 100, "min_temperature": 14, "max_temperature": 33},
+    "meeting": {"max_precipitation": 0.1, "rain": False, "snow": False, "max_cloud_cover": 100, "min_temperature": 12, "max_temperature": 30},
+    "party": {"max_precipitation": 0.1, "rain": False, "snow": False, "max_cloud_cover": 90, "min_temperature": 15, "max_temperature": 34},
+    "running": {"max_precipitation": 1.0, "rain": True, "snow": False, "max_cloud_cover": 100, "min_temperature": -5, "max_temperature": 28},
+    "walking": {"max_precipitation": 0.5, "rain": False, "snow": True, "max_cloud_cover": 100, "min_temperature": -5, "max_temperature": 32},
+    "working": {"max_precipitation": 0.1, "rain": False, "snow": False, "max_cloud_cover": 100, "min_temperature": 15, "max_temperature": 30},
+    "other": {"max_precipitation": 0.2, "rain": False, "snow": False, "max_cloud_cover": 100, "min_temperature": 5, "max_temperature": 32},
+}
+
+# Categorical flags are averaged over the period, anything at or above this counts as "yes"
+CATEGORICAL_THRESHOLD = 0.5
+
+
+def strip_period(parameter: str) -> str:
+    return parameter.rsplit("/", 1)[0]
+
+
+def rule_parameters(parameters) -> list:
+    """
+    Returns the parameters of a collection that the rules need.
+    """
+    return [p for p in parameters if strip_period(p) in RULE_PARAMETERS]
+
+
+def read_values(weather_data: dict) -> dict:
+    """
+    Converts weather data in the format of weather.get_weather_data into {parameter without period: value},
+    with precipitation in mm/h and temperatures in degrees Celsius.
+    """
+    values = {}
+    for parameter, entry in (weather_data or {}).items():
+        value = entry.get("value")
+        if value is None:
+            continue
+        name = strip_period(parameter)
+        unit = entry.get("unit") or ""
+        if name == PRECIPITATION_RATE and unit.startswith("kg"):
+            # kg m-2 s-1 is the same as mm/s
+            value = value * 3600
+        elif name in (MAXIMUM_TEMPERATURE, MINIMUM_TEMPERATURE) and unit == "K":
+            value = value - 273.15
+        values[name] = value
+    return values
+
+
+def evaluate(activity: str, weather_data: dict) -> Tuple[Optional[bool], str]:
+    """
+    Decides if the weather is suitable for an outdoor activity.
+
+    Returns (suitable, reason). suitable is None if the rules cannot decide because parameters are missing,
+    in which case the caller should ask the LLM.
+    """
+    activity = activity if activity in ACTIVITY_THRESHOLDS else "other"
+    thresholds = ACTIVITY_THRESHOLDS[activity]
+    values = read_values(weather_data)
+    problems = []
+    missing = []
+
+    precipitation = values.get(PRECIPITATION_RATE)
+    if precipitation is None:
+        missing.append(PRECIPITATION_RATE)
+    elif precipitation > thresholds["max_precipitation"]:
+        problems.append(f"precipitation of {precipitation:.1f} mm/h is expected")
+
+    for name, allowed, label in ((CATEGORICAL_RAIN, thresholds["rain"], "rain"), (CATEGORICAL_SNOW, thresholds["snow"], "snow")):
+        flag = values.get(name)
+        if flag is None:
+            missing.append(name)
+        elif flag >= CATEGORICAL_THRESHOLD and not allowed:
+            problems.append(f"{label} is forecast")
+
+    cloud_cover = values.get(CLOUD_COVER)
+    if cloud_cover is not None and cloud_cover > thresholds["max_cloud_cover"]:
+        problems.append(f"the sky is overcast ({cloud_cover:.0f} % cloud cover)")
+
+    minimum = values.get(MINIMUM_TEMPERATURE)
+    maximum = values.get(MAXIMUM_TEMPERATURE)
+    if minimum is None and maximum is None:
+        missing.append(MINIMUM_TEMPERATURE)
+    if minimum is not None and minimum < thresholds["min_temperature"]:
+        problems.append(f"it is too cold ({minimum:.0f} °C)")
+    if maximum is not None and maximum > thresholds["max_temperature"]:
+        problems.append(f"it is too hot ({maximum:.0f} °C)")
+
+    if problems:
+        return False, f"The weather is not suitable for {activity}: " + ", ".join(problems) + "."
+    if missing:
+        return None, ""
+
+    details = ["no relevant precipitation"]
+    if minimum is not None and maximum is not None:
+        details.append(f"temperatures between {minimum:.0f} and {maximum:.0f} °C")
+    if cloud_cover is not None:
+        details.append(f"{cloud_cover:.0f} % cloud cover")
+    return True, f"The weather is suitable for {activity}: " + ", ".join(details) + "."
@@ -0,0 +1,44 @@
+from fastapi.testclient import TestClient
+import api
+
+client = TestClient(api.app)
+
+TASK = {"taskId": 1, "title": "Walk", "date": "2024-04-06", "startTime": "10:00", "endTime": "11:00", "activity": "walking", "description": "A walk", "latitude": 48.72, "longitude": 21.25, "indoor": False}
+
+
+def fake_bulk_upsert(written):
+    async def bulk_upsert_tasks(task_data, chunk_size=None, username=None):
+        assert username == "jpassweg"
+        written.append(task_data)
+        return [{"status": "updated" if task["taskId"] == 1 else "inserted"} for task in task_data]
+    return bulk_upsert_tasks
+
+
+def test_bulk_json_reports_status_per_item(monkeypatch):
+    written = []
+    monkeypatch.setattr(api.db, "bulk_upsert_tasks", fake_bulk_upsert(written))
+    response = client.post("/task/many/", json=[TASK, {"title": "missing fields"}, {**TASK, "taskId": 2}])
+    assert response.status_code == 200
+    response_data = response.json()
+    assert (response_data["inserted"], response_data["updated"], response_data["failed"]) == (1, 1, 1)
+    assert [item["status"] for item in response_data["items"]] == ["updated", "failed", "inserted"]
+
+
+def test_bulk_ndjson_is_written_in_chunks(monkeypatch):
+    written = []
+    monkeypatch.setattr(api.db, "bulk_upsert_tasks", fake_bulk_upsert(written))
+    monkeypatch.setattr(api.db, "TASK_BULK_CHUNK_SIZE", 2)
+    lines = "\n".join(api.json.dumps({**TASK, "taskId": i}) for i in range(1, 6)) + "\nnot json\n"
+    response = client.post("/task/many/", content=lines, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    response_data = response.json()
+    assert [item["index"] for item in response_data["items"]] == list(range(6))
+    assert response_data["inserted"] == 4 and response_data["updated"] == 1 and response_data["failed"] == 1
+    assert [len(chunk) for chunk in written] == [2, 2, 1]
+
+
+def test_bulk_body_is_described_in_openapi():
+    body = client.get("/openapi.json").json()["paths"]["/task/many/"]["post"]["requestBody"]
+    assert body["content"]["application/json"]["schema"]["type"] == "array"
+    assert "title" in body["content"]["application/json"]["schema"]["items"]["properties"]
+    assert "application/x-ndjson" in body["content"]
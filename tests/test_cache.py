@@ -0,0 +1,28 @@
+from cache import TTLCache
+from weather import snap_to_grid
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats()["hits"] == 3
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_snap_to_grid():
+    assert snap_to_grid(48.72) == 48.5
+    assert snap_to_grid(48.76) == 49.0
+    assert snap_to_grid(21.257) == 21.5
+    assert snap_to_grid(-0.2) == 0.0
@@ -0,0 +1,72 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import llm
+from cache import TTLCache
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content='{"suitable": true}')
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def fake_client(monkeypatch):
+    completions = FakeCompletions()
+    monkeypatch.setattr(llm, "get_client", lambda: SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(llm, "completion_cache", TTLCache(16, 60))
+    monkeypatch.setattr(llm, "completion_store", None)
+    monkeypatch.setattr(llm, "cache_stats", {"store_hits": 0, "bytes_saved": 0})
+    return completions
+
+
+def test_identical_prompt_is_answered_from_cache(monkeypatch):
+    completions = fake_client(monkeypatch)
+    messages = [{"role": "user", "content": "Is it sunny?"}]
+
+    async def run():
+        first = await llm.complete("model", messages, {"type": "json_object"}, cache=True)
+        second = await llm.complete("model", [dict(m) for m in messages], {"type": "json_object"}, cache=True)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second == '{"suitable": true}'
+    assert completions.calls == 1
+    assert llm.get_cache_stats()["bytes_saved"] == len(first)
+
+
+def test_uncached_and_different_prompts_reach_upstream(monkeypatch):
+    completions = fake_client(monkeypatch)
+
+    async def run():
+        await llm.complete("model", [{"role": "user", "content": "a"}], cache=True)
+        await llm.complete("model", [{"role": "user", "content": "b"}], cache=True)
+        await llm.complete("model", [{"role": "user", "content": "a"}])
+
+    asyncio.run(run())
+    assert completions.calls == 3
+
+
+def test_disk_store_survives_a_new_cache(tmp_path):
+    store = llm.DiskCompletionStore(str(tmp_path))
+    asyncio.run(store.set("key", "content", 60))
+    assert asyncio.run(store.get("key")) == "content"
+    assert asyncio.run(store.get("other")) is None
+    asyncio.run(store.set("old", "content", -1))
+    assert asyncio.run(store.get("old")) is None
+    # expired entries are deleted when they are read
+    assert not os.path.exists(store.path("old"))
+
+
+def test_disk_store_drops_the_oldest_files(tmp_path):
+    store = llm.DiskCompletionStore(str(tmp_path), max_size=2)
+    for age, key in enumerate(["first", "second", "third"]):
+        asyncio.run(store.set(key, "content", 60))
+        os.utime(store.path(key), (1000 + age, 1000 + age))
+    asyncio.run(store.set("fourth", "content", 60))
+    assert sorted(os.listdir(tmp_path)) == ["fourth.json", "third.json"]
@@ -0,0 +1,44 @@
+import numpy as np
+
+import coveragejson
+
+
+def point(x, y, param, times, values):
+    axes = {"x": {"values": [x]}, "y": {"values": [y]}, "t": {"values": times}}
+    return {"domain": {"axes": axes}, "ranges": {param: {"values": values}}}
+
+
+def parameter(unit, label):
+    return {"unit": {"symbol": unit}, "observedProperty": {"label": {"en": label}}}
+
+
+def test_coverages_are_decoded_into_columns():
+    data = {
+        "parameters": {"rain": parameter("kg m-2 s-1", "Precipitation rate"), "cloud": parameter("%", "Total cloud cover")},
+        "coverages": [
+            point(17.0, 48.0, "rain", ["2024-04-06T00:00:00Z", "2024-04-06T03:00:00Z"], [0.0, None]),
+            point(17.0, 48.0, "cloud", ["2024-04-06T03:00:00Z", "2024-04-06T06:00:00Z"], [50.0, 60.0]),
+            point(8.5, 47.5, "rain", ["2024-04-06T06:00:00Z"], [0.001]),
+        ],
+    }
+    columns = coveragejson.decode(coveragejson.loads(coveragejson.json.dumps(data).encode()))
+
+    assert columns["time"].tolist() == [np.datetime64("2024-04-06T00:00:00").tolist(), np.datetime64("2024-04-06T03:00:00").tolist(), np.datetime64("2024-04-06T06:00:00").tolist()]
+    assert columns["points"] == [(17.0, 48.0), (8.5, 47.5)]
+    assert columns["parameters"]["rain"]["values"].shape == (2, 3)
+    assert coveragejson.to_list(columns["parameters"]["rain"]["values"][0]) == [0.0, None, None]
+    assert coveragejson.to_list(columns["parameters"]["rain"]["values"][1]) == [None, None, 0.001]
+    assert coveragejson.to_list(columns["parameters"]["cloud"]["values"][1]) == [None, None, None]
+    assert columns["parameters"]["cloud"]["unit"] == "%"
+
+
+def test_coverage_without_time_axis_is_one_step():
+    data = {
+        "parameters": {"rain": parameter("kg m-2 s-1", "Precipitation rate")},
+        "coverages": [{"ranges": {"rain": {"values": [0.002]}}}],
+    }
+    columns = coveragejson.decode(data)
+
+    assert len(columns["time"]) == 1 and np.isnat(columns["time"][0])
+    assert columns["points"] == [(None, None)]
+    assert coveragejson.to_list(columns["parameters"]["rain"]["values"][0]) == [0.002]
@@ -0,0 +1,55 @@
+import asyncio
+
+import httpx
+import pytest
+
+import edr
+
+
+def use_transport(monkeypatch, handler):
+    requests = []
+
+    def record(request):
+        requests.append(request)
+        return handler(len(requests))
+
+    monkeypatch.setattr(edr, "client", httpx.AsyncClient(transport=httpx.MockTransport(record)))
+    monkeypatch.setattr(edr, "EDR_RETRY_BACKOFF", 0)
+    monkeypatch.setattr(edr, "EDR_RETRIES", 2)
+    return requests
+
+
+@pytest.mark.parametrize("status_code", sorted(edr.RETRY_STATUS_CODES))
+def test_retryable_status_is_retried(monkeypatch, status_code):
+    requests = use_transport(monkeypatch, lambda attempt: httpx.Response(status_code if attempt == 1 else 200))
+
+    response = asyncio.run(edr.get("https://example.com/collections"))
+    assert response.status_code == 200
+    assert len(requests) == 2
+
+
+def test_other_status_is_returned_at_once(monkeypatch):
+    requests = use_transport(monkeypatch, lambda attempt: httpx.Response(404))
+
+    assert asyncio.run(edr.get("https://example.com/collections")).status_code == 404
+    assert len(requests) == 1
+
+
+def test_last_response_is_returned_after_all_retries(monkeypatch):
+    requests = use_transport(monkeypatch, lambda attempt: httpx.Response(503, text=str(attempt)))
+
+    response = asyncio.run(edr.get("https://example.com/collections"))
+    assert response.status_code == 503
+    assert response.text == "3"
+    assert len(requests) == 3
+
+
+def test_transport_error_is_raised_after_all_retries(monkeypatch):
+    def fail(attempt):
+        raise httpx.ConnectError("down")
+
+    requests = use_transport(monkeypatch, fail)
+
+    with pytest.raises(httpx.ConnectError):
+        asyncio.run(edr.get("https://example.com/collections"))
+    assert len(requests) == 3
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import httpx
+
+import weather
+
+
+class FakeResponse:
+    def __init__(self, status_code, values=None, etag=None):
+        self.status_code = status_code
+        self.headers = {"etag": etag} if etag else {}
+        self._values = values
+
+    def json(self):
+        return {"extent": {"temporal": {"values": self._values}}}
+
+
+def test_extent_is_cached_and_revalidated(monkeypatch):
+    url = "https://example.com/collections/test"
+    calls = []
+
+    async def fake_get(url, params=None, headers=None):
+        calls.append(headers)
+        if headers and headers.get("If-None-Match") == '"run-1"':
+            return FakeResponse(304)
+        return FakeResponse(200, ["2024-04-06T00:00:00Z", "2024-04-06T03:00:00Z"], etag='"run-1"')
+
+    monkeypatch.setattr(weather.edr, "get", fake_get)
+    weather.extent_cache.pop(url, None)
+    hits = weather.extent_stats["hits"]
+
+    first = asyncio.run(weather.get_temporal_extent(url))
+    second = asyncio.run(weather.get_temporal_extent(url))
+    assert first == second
+    assert len(calls) == 1
+    assert weather.extent_stats["hits"] == hits + 1
+
+    # once the TTL has passed the extent is revalidated instead of downloaded again
+    weather.extent_cache[url]["expires"] = 0
+    third = asyncio.run(weather.get_temporal_extent(url))
+    assert third == first
+    assert calls[-1]["If-None-Match"] == '"run-1"'
+
+
+def test_cached_extent_is_used_when_revalidation_fails(monkeypatch):
+    url = "https://example.com/collections/failing"
+    failures = [FakeResponse(503), httpx.ConnectError("down")]
+
+    async def fake_get(url, params=None, headers=None):
+        if not headers:
+            return FakeResponse(200, ["2024-04-06T00:00:00Z", "2024-04-06T03:00:00Z"], etag='"run-1"')
+        failure = failures.pop(0)
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    monkeypatch.setattr(weather.edr, "get", fake_get)
+    weather.extent_cache.pop(url, None)
+    first = asyncio.run(weather.get_temporal_extent(url))
+
+    for _ in range(2):
+        weather.extent_cache[url]["expires"] = 0
+        assert asyncio.run(weather.get_temporal_extent(url)) == first
+        # the failed revalidation is retried soon instead of after the full TTL
+        assert weather.extent_cache[url]["expires"] <= time.monotonic() + weather.EXTENT_RETRY
+    assert failures == []
@@ -0,0 +1,74 @@
+import json
+
+import pytest
+
+from api import read_single_extraction
+
+TASK = {
+    "title": "Morning walk",
+    "date": "2024-04-06",
+    "startTime": "10:00",
+    "endTime": "11:00",
+    "activity": "walking",
+    "description": "A walk in the park",
+    "latitude": 48.72,
+    "longitude": 21.25,
+    "indoor": False,
+}
+
+
+def test_complete_task():
+    task, success, message = read_single_extraction({"task": TASK, "missing": [], "message": "Your walk was created."})
+    assert success
+    assert message == "Your walk was created."
+
+
+def test_missing_entry_keeps_the_question_of_the_model():
+    answer = {"task": {**TASK, "startTime": "EMPTY"}, "missing": ["startTime"], "message": "When do you want to start?"}
+    task, success, message = read_single_extraction(answer)
+    assert not success
+    assert message == "When do you want to start?"
+
+
+def test_invalid_entry_overrides_a_premature_summary():
+    answer = {"task": {**TASK, "date": "tomorrow"}, "missing": [], "message": "Your walk was created."}
+    task, success, message = read_single_extraction(answer)
+    assert not success
+    assert task["date"] == "EMPTY"
+    assert message == "On which day does the event take place?"
+
+
+@pytest.mark.parametrize("answer", [[TASK], {"task": [TASK]}, {"task": "walk"}])
+def test_answer_of_the_wrong_shape_asks_again(answer):
+    task, success, message = read_single_extraction(answer)
+    assert not success
+    assert task == {key: "EMPTY" for key in TASK}
+    assert message == "Could you give me more details about the event?"
+
+
+def test_unreadable_missing_list_is_ignored():
+    task, success, message = read_single_extraction({"task": TASK, "missing": 3, "message": "Your walk was created."})
+    assert success
+    assert message == "Your walk was created."
+
+
+def test_text_stream_sends_tokens_and_task(monkeypatch):
+    import api
+    from fastapi.testclient import TestClient
+
+    answer = "Your walk was ###created.\n###TA" + "SK###\n" + json.dumps({"task": TASK, "missing": []})
+
+    async def stream_complete(model, messages, timeout=None):
+        for start in range(0, len(answer), 4):
+            yield answer[start:start + 4]
+
+    monkeypatch.setattr(api.llm, "stream_complete", stream_complete)
+    response = TestClient(api.app).post("/text/stream", json={"messages": ["Walk tomorrow at 10"]})
+    assert response.status_code == 200
+    events = [block.split("\n", 1) for block in response.text.strip().split("\n\n")]
+    tokens = [json.loads(data[len("data: "):])["text"] for event, data in events if event == "event: token"]
+    assert "".join(tokens) == "Your walk was ###created.\n"
+    assert events[-1][0] == "event: task"
+    final = json.loads(events[-1][1][len("data: "):])
+    assert final["success"] and final["message"] == "Your walk was ###created."
+    assert final["task"]["latitude"] == 48.72
@@ -0,0 +1,29 @@
+import asyncio
+import api
+
+
+def test_earliest_suitable_slot_wins_and_rest_is_cancelled(monkeypatch):
+    finished = []
+
+    async def check_suitability(task, weather_data):
+        # later slots answer faster, the earliest suitable one must still win
+        await asyncio.sleep(0.05 / weather_data["slot"])
+        finished.append(weather_data["slot"])
+        return {"suitable": weather_data["slot"] >= 2, "reason": str(weather_data["slot"])}
+
+    monkeypatch.setattr(api, "check_suitability", check_suitability)
+    monkeypatch.setattr(api, "NEW_TIME_CONCURRENCY", 2)
+    candidates = [(slot, {"slot": slot}) for slot in range(1, 11)]
+
+    new_date, response = asyncio.run(api.find_first_suitable({}, candidates))
+    assert new_date == 2
+    assert response["reason"] == "2"
+    assert len(finished) < len(candidates)
+
+
+def test_no_suitable_slot(monkeypatch):
+    async def check_suitability(task, weather_data):
+        return {"suitable": False, "reason": "rain"}
+
+    monkeypatch.setattr(api, "check_suitability", check_suitability)
+    assert asyncio.run(api.find_first_suitable({}, [(1, {}), (2, {})])) == (None, {"suitable": False, "reason": "rain"})
@@ -0,0 +1,145 @@
+import asyncio
+from datetime import datetime
+
+import prefetch
+
+
+def task(task_id, latitude, longitude, start="12:00", activity="walking"):
+    return {"taskID": task_id, "taskId": task_id, "title": "t", "date": "2024-04-06", "startTime": start, "endTime": "13:00",
+            "activity": activity, "description": "d", "latitude": latitude, "longitude": longitude, "indoor": False}
+
+
+RUN = datetime(2024, 4, 6, 0)
+SERIES = {
+    "time": [datetime(2024, 4, 6, 9), datetime(2024, 4, 6, 12)],
+    "parameters": {
+        "precipitation-rate_gnd-surf_stat:avg/PT3H": {"unit": "kg m-2 s-1", "description": "", "values": [0.0, 0.001]},
+        "categorical-rain-yes-1-no-0_gnd-surf_stat:avg/PT3H": {"unit": "", "description": "", "values": [0.0, 1.0]},
+        "categorical-snow-yes-1-no-0_gnd-surf_stat:avg/PT3H": {"unit": "", "description": "", "values": [0.0, 0.0]},
+        "minimum-temperature_stat:min/PT3H": {"unit": "K", "description": "", "values": [290.0, 290.0]},
+    },
+}
+
+
+def test_tasks_are_grouped_by_grid_cell_and_verdicts_stored(monkeypatch):
+    tasks = [task(1, 48.14, 17.1, "10:00"), task(2, 48.1, 17.12, "12:00"), task(3, 48.1, 17.12, "10:00", "party")]
+    fresh = task(4, 50.0, 10.0)
+    fresh["weather"] = prefetch.make_verdict(fresh, True, "", RUN)
+    series_calls, stored = [], {}
+
+    async def fake_stream_tasks(**kwargs):
+        assert kwargs["indoor"] is False
+        for t in tasks + [fresh]:
+            yield t
+
+    async def fake_series(x, y, from_date, to_date, description, duration=None, activity=None, rules_only=False):
+        series_calls.append((x, y, from_date, to_date, rules_only))
+        return SERIES
+
+    async def fake_set_task_weather(id, weather, username):
+        stored[id] = weather
+        return True
+
+    monkeypatch.setattr(prefetch.db, "stream_tasks", fake_stream_tasks)
+    monkeypatch.setattr(prefetch.db, "set_task_weather", fake_set_task_weather)
+    monkeypatch.setattr(prefetch.weather, "get_weather_series", fake_series)
+    monkeypatch.setattr(prefetch.weather, "forecast_run", lambda url: RUN)
+
+    asyncio.run(prefetch.scan_user("jpassweg", datetime(2024, 4, 6, 8), asyncio.Semaphore(2)))
+
+    assert series_calls == [(48.14, 17.1, datetime(2024, 4, 6, 10), datetime(2024, 4, 6, 12), True)]
+    assert set(stored) == {1, 2, 3}
+    assert stored[1]["suitable"] is True and stored[1]["run"] == "2024-04-06T00:00:00Z"
+    assert stored[2]["suitable"] is False
+    # the party has no cloud cover or maximum temperature, but it is warm and dry enough
+    assert stored[3]["suitable"] is True
+
+
+def test_verdict_is_only_reused_for_the_same_task_and_run():
+    verdict = prefetch.make_verdict(task(1, 48.1, 17.1), False, "rain", RUN)
+    renamed = dict(task(1, 48.1, 17.1), title="renamed")
+
+    assert prefetch.is_fresh(task(1, 48.1, 17.1), verdict, RUN)
+    assert prefetch.is_fresh(renamed, verdict, RUN)
+    assert not prefetch.is_fresh(task(1, 48.1, 17.1, "15:00"), verdict, RUN)
+    assert not prefetch.is_fresh(task(1, 48.1, 17.1), verdict, datetime(2024, 4, 6, 6))
+    assert not prefetch.is_fresh(task(1, 48.1, 17.1), None, RUN)
+
+
+def test_stored_verdict_is_returned_while_it_is_fresh(monkeypatch):
+    stored = {"weather": prefetch.make_verdict(task(1, 48.1, 17.1), False, "rain", RUN)}
+
+    async def fake_find_task(id, fields, username):
+        assert fields == ["weather"]
+        return stored
+
+    async def fake_extent(url):
+        return [RUN]
+
+    monkeypatch.setattr(prefetch.db, "find_task", fake_find_task)
+    monkeypatch.setattr(prefetch.weather, "get_temporal_extent", fake_extent)
+    monkeypatch.setattr(prefetch.weather, "forecast_run", lambda url: RUN)
+
+    assert asyncio.run(prefetch.stored_verdict(task(1, 48.1, 17.1))) == {"suitable": False, "reason": "rain"}
+    assert asyncio.run(prefetch.stored_verdict(task(1, 48.1, 17.1, activity="running"))) is None
+    monkeypatch.setattr(prefetch.weather, "forecast_run", lambda url: datetime(2024, 4, 6, 6))
+    assert asyncio.run(prefetch.stored_verdict(task(1, 48.1, 17.1))) is None
+
+
+def test_update_rechecks_only_replaced_tasks(monkeypatch):
+    from fastapi.testclient import TestClient
+    import api
+
+    replaced, rechecked = [False], []
+
+    async def fake_update_task(task_data, username=None):
+        return replaced[0]
+
+    monkeypatch.setattr(api.db, "update_task", fake_update_task)
+    monkeypatch.setattr(api.prefetch, "recheck", lambda task, username: rechecked.append(task["taskId"]))
+    client = TestClient(api.app)
+    body = {k: v for k, v in task(7, 48.1, 17.1).items() if k != "taskID"}
+
+    client.put("/task", json=body)
+    assert rechecked == []
+    replaced[0] = True
+    client.put("/task", json=body)
+    assert rechecked == [7]
+
+
+def test_long_task_in_a_six_hour_step_gets_a_verdict(monkeypatch):
+    long_task = dict(task(5, 48.1, 17.1, "10:00"), endTime="16:00")
+    stored = {}
+    step = datetime(2024, 4, 6, 6)
+    # the task starts 4 hours into the 06:00 step, the series up to its start only holds that step
+    steps = ["2024-04-06T06:00:00Z", "2024-04-06T12:00:00Z"]
+    rain = "precipitation-rate_gnd-surf_stat:avg/PT6H"
+    requested = []
+
+    async def fake_stream_tasks(**kwargs):
+        yield long_task
+
+    async def fake_extent(url):
+        monkeypatch.setitem(prefetch.weather.extent_cache, url, {"times": prefetch.weather.parse_times(steps), "run": RUN})
+        return prefetch.weather.parse_times(steps).tolist()
+
+    async def fake_position_series(url, x, y, start, end, parameters, z=None, run=None):
+        requested.append(url)
+        names = parameters if z is None else ["minimum-temperature_stat:min/PT6H"]
+        values = {rain: 0.0, "minimum-temperature_stat:min/PT6H": 290.0}
+        return {"time": [step], "parameters": {p: {"unit": "K" if "temperature" in p else "", "description": "", "values": [values.get(p, 0.0)]} for p in names}}
+
+    async def fake_set_task_weather(id, weather, username):
+        stored[id] = weather
+        return True
+
+    monkeypatch.setattr(prefetch.db, "stream_tasks", fake_stream_tasks)
+    monkeypatch.setattr(prefetch.db, "set_task_weather", fake_set_task_weather)
+    monkeypatch.setattr(prefetch.weather, "get_temporal_extent", fake_extent)
+    monkeypatch.setattr(prefetch.weather, "get_position_series", fake_position_series)
+    monkeypatch.setattr(prefetch.weather, "forecast_run", lambda url: RUN)
+
+    asyncio.run(prefetch.scan_user("jpassweg", datetime(2024, 4, 6, 8), asyncio.Semaphore(1)))
+
+    assert requested[0] == prefetch.weather.SINGLE_LAYER_3
+    assert stored[5]["suitable"] is True
@@ -0,0 +1,37 @@
+import asyncio
+import weather
+from weather import SINGLE_LAYER_2_PARAMETERS, classify_activity, select_parameters
+
+
+def test_classify_activity():
+    assert classify_activity("running", "") == "running"
+    assert classify_activity("other", "A relaxing walk in the park") == "walking"
+    assert classify_activity("other", "Planting crops in the field") is None
+
+
+def test_known_activity_needs_no_llm(monkeypatch):
+    async def fail(*args, **kwargs):
+        raise AssertionError("the LLM must not be called")
+
+    monkeypatch.setattr(weather.llm, "complete", fail)
+    parameters = asyncio.run(select_parameters("Coffee with Anna", SINGLE_LAYER_2_PARAMETERS, "coffee"))
+    assert "precipitation-rate_gnd-surf_stat:avg/PT3H" in parameters
+    assert "downward-short-wave-radiation-flux_gnd-surf_stat:avg/PT3H" in parameters
+    assert all(p in SINGLE_LAYER_2_PARAMETERS for p in parameters)
+
+
+def test_unknown_description_is_memoized(monkeypatch):
+    calls = []
+
+    async def complete(*args, **kwargs):
+        calls.append(kwargs)
+        return '{"required_parameters": ["albedo_gnd-surf_stat:avg/PT3H", "not-a-parameter"]}'
+
+    monkeypatch.setattr(weather.llm, "complete", complete)
+    weather.parameter_cache.clear()
+    first = asyncio.run(select_parameters("Planting  crops", SINGLE_LAYER_2_PARAMETERS, "other"))
+    second = asyncio.run(select_parameters("planting crops", SINGLE_LAYER_2_PARAMETERS, "other"))
+    assert first == second
+    assert first[0] == "albedo_gnd-surf_stat:avg/PT3H"
+    assert "not-a-parameter" not in first
+    assert len(calls) == 1
@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import weather
+from cache import TTLCache
+from singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def run():
+        results = await asyncio.gather(*(flights.do("a", work, 1) for _ in range(5)), flights.do("b", work, 2))
+        # once finished, the next call runs again
+        results.append(await flights.do("a", work, 1))
+        return results
+
+    assert asyncio.run(run()) == [2, 2, 2, 2, 2, 4, 2]
+    assert calls == [1, 2, 1]
+    assert flights.stats() == {"in_flight": 0, "calls": 7, "shared": 4}
+
+
+def test_exception_reaches_every_waiter():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream down")
+
+    async def run():
+        return await asyncio.gather(flights.do("a", fail), flights.do("a", fail), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(r) for r in results] == [ValueError, ValueError]
+    assert flights.flights == {}
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flights.do("a", work))
+        second = asyncio.ensure_future(flights.do("a", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+
+class FakeResponse:
+    status_code = 200
+
+    def json(self):
+        return {
+            "parameters": {"p": {"unit": {"symbol": "K"}, "observedProperty": {"label": {"en": "P"}}}},
+            "coverages": [{"ranges": {"p": {"values": [280.0]}}}],
+        }
+
+
+def test_identical_positions_send_one_request(monkeypatch):
+    requests = []
+
+    async def fake_get(url, params=None, headers=None):
+        requests.append(params)
+        await asyncio.sleep(0.01)
+        return FakeResponse()
+
+    monkeypatch.setattr(weather.edr, "get", fake_get)
+    monkeypatch.setattr(weather, "point_cache", TTLCache(16, 60))
+    date = datetime(2024, 4, 6, 12)
+
+    async def run():
+        return await asyncio.gather(
+            weather.get_position("url", 48.14, 17.1, date, ["p"]),
+            weather.get_position("url", 48.1, 17.12, date, ["p"]),
+        )
+
+    first, second = asyncio.run(run())
+    assert first == second == {"p": {"unit": "K", "description": "P", "value": 280.0}}
+    assert len(requests) == 1
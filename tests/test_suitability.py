@@ -0,0 +1,50 @@
+from suitability import evaluate, rule_parameters
+from weather import SINGLE_LAYER_3_PARAMETERS
+
+
+def weather(precipitation=0.0, rain=0.0, snow=0.0, cloud_cover=20.0, minimum=288.15, maximum=295.15):
+    return {
+        "precipitation-rate_gnd-surf_stat:avg/PT3H": {"unit": "kg m-2 s-1", "description": "", "value": precipitation},
+        "categorical-rain-yes-1-no-0_gnd-surf_stat:avg/PT3H": {"unit": "1", "description": "", "value": rain},
+        "categorical-snow-yes-1-no-0_gnd-surf_stat:avg/PT3H": {"unit": "1", "description": "", "value": snow},
+        "total-cloud-cover_atmosphere_stat:avg/PT3H": {"unit": "%", "description": "", "value": cloud_cover},
+        "minimum-temperature_stat:min/PT3H": {"unit": "K", "description": "", "value": minimum},
+        "maximum-temperature_stat:max/PT3H": {"unit": "K", "description": "", "value": maximum},
+    }
+
+
+def test_dry_mild_weather_is_suitable():
+    suitable, reason = evaluate("walking", weather())
+    assert suitable is True
+    assert "walking" in reason
+
+
+def test_rain_is_not_suitable_for_coffee_but_for_running():
+    rainy = weather(precipitation=0.0002, rain=1.0)
+    assert evaluate("coffee", rainy)[0] is False
+    assert evaluate("running", rainy)[0] is True
+
+
+def test_temperature_limits():
+    assert evaluate("party", weather(minimum=278.15, maximum=281.15))[0] is False
+    assert evaluate("running", weather(minimum=300.15, maximum=305.15))[0] is False
+
+
+def test_missing_parameters_are_undecided():
+    data = weather()
+    del data["precipitation-rate_gnd-surf_stat:avg/PT3H"]
+    assert evaluate("walking", data) == (None, "")
+    assert evaluate("walking", None) == (None, "")
+
+
+def test_unknown_activity_uses_defaults():
+    assert evaluate("surfing", weather())[0] is True
+
+
+def test_rule_parameters_of_a_collection():
+    assert sorted(rule_parameters(SINGLE_LAYER_3_PARAMETERS)) == [
+        "categorical-rain-yes-1-no-0_gnd-surf_stat:avg/PT6H",
+        "categorical-snow-yes-1-no-0_gnd-surf_stat:avg/PT6H",
+        "precipitation-rate_gnd-surf_stat:avg/PT6H",
+        "total-cloud-cover_atmosphere_stat:avg/PT6H",
+    ]
@@ -0,0 +1,34 @@
+import json
+
+from fastapi.testclient import TestClient
+import api
+
+client = TestClient(api.app)
+
+
+def test_export_streams_one_line_per_task(monkeypatch):
+    calls = []
+
+    async def fake_stream_tasks(**kwargs):
+        calls.append(kwargs)
+        for task_id in (1, 2, 3):
+            yield {"taskID": task_id, "title": f"Task {task_id}", "date": "2024-04-06"}
+
+    monkeypatch.setattr(api.db, "stream_tasks", fake_stream_tasks)
+    response = client.get("/task/export", params={"sort": "date", "activity": "walking", "batch_size": 2})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert [json.loads(line)["taskID"] for line in lines] == [1, 2, 3]
+    assert calls[0]["sort"] == "date" and calls[0]["activity"] == "walking" and calls[0]["batch_size"] == 2
+
+
+def test_export_rejects_unknown_sort(monkeypatch):
+    async def fake_stream_tasks(**kwargs):
+        raise AssertionError("must not be called")
+        yield
+
+    monkeypatch.setattr(api.db, "stream_tasks", fake_stream_tasks)
+    response = client.get("/task/export", params={"sort": "title"})
+    assert response.status_code == 400
@@ -0,0 +1,34 @@
+import pytest
+from bson import ObjectId
+from mongo_calls import decode_cursor, encode_cursor, task_filter
+
+
+def test_task_filter():
+    assert task_filter() == {}
+    assert task_filter(date_from="2024-04-01", date_to="2024-04-07", activity="walking", indoor=False) == {
+        "date": {"$gte": "2024-04-01", "$lte": "2024-04-07"},
+        "activity": "walking",
+        "indoor": False,
+    }
+
+
+def test_cursor_round_trip():
+    _id = ObjectId()
+    keys = ["date", "startTime", "_id"]
+    cursor = encode_cursor({"_id": _id, "date": "2024-04-06", "startTime": "10:00"}, keys)
+    assert decode_cursor(cursor, keys) == {"$or": [
+        {"date": {"$gt": "2024-04-06"}},
+        {"date": "2024-04-06", "startTime": {"$gt": "10:00"}},
+        {"date": "2024-04-06", "startTime": "10:00", "_id": {"$gt": _id}},
+    ]}
+
+
+def test_cursor_after_missing_value():
+    _id = ObjectId()
+    cursor = encode_cursor({"_id": _id}, ["taskID", "_id"])
+    assert decode_cursor(cursor, ["taskID", "_id"])["$or"][0] == {"taskID": {"$ne": None}}
+
+
+def test_invalid_cursor():
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor", ["taskID", "_id"])
@@ -0,0 +1,73 @@
+import asyncio
+
+import mongo_calls as db
+from pymongo import ReturnDocument
+
+
+class FakeCollection:
+    """
+    Records the calls of update_task and delete_task and answers them with result.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    async def find_one_and_replace(self, filter, replacement, **kwargs):
+        self.calls.append(("replace", filter, replacement, kwargs))
+        return self.result
+
+    async def find_one_and_delete(self, filter, **kwargs):
+        self.calls.append(("delete", filter, kwargs))
+        return self.result
+
+
+def use_collection(monkeypatch, collection):
+    async def fake_get_user_collection(username):
+        assert username == "jpassweg"
+        return collection
+
+    monkeypatch.setattr(db, "get_user_collection", fake_get_user_collection)
+
+
+def test_update_replaces_the_task_by_its_taskID(monkeypatch):
+    collection = FakeCollection({"_id": "abc"})
+    use_collection(monkeypatch, collection)
+
+    task = {"_id": "stale", "taskId": 7, "title": "walk"}
+    assert asyncio.run(db.update_task(task, upsert=True, username="jpassweg")) is True
+
+    kind, filter, replacement, kwargs = collection.calls[0]
+    assert kind == "replace"
+    assert filter == {"taskID": 7}
+    # taskId is copied to taskID and the _id of the request is not written
+    assert replacement == {"taskId": 7, "taskID": 7, "title": "walk"}
+    assert kwargs == {"projection": {"_id": 1}, "upsert": True, "return_document": ReturnDocument.AFTER}
+    assert "_id" in task
+
+
+def test_update_of_a_missing_task_returns_false(monkeypatch):
+    collection = FakeCollection(None)
+    use_collection(monkeypatch, collection)
+
+    assert asyncio.run(db.update_task({"taskID": 8}, username="jpassweg")) is False
+    assert collection.calls[0][3]["upsert"] is False
+
+
+def test_update_without_an_id_does_not_reach_the_collection(monkeypatch):
+    collection = FakeCollection({"_id": "abc"})
+    use_collection(monkeypatch, collection)
+
+    assert asyncio.run(db.update_task({"title": "walk"}, username="jpassweg")) is False
+    assert collection.calls == []
+
+
+def test_delete_returns_whether_a_task_was_deleted(monkeypatch):
+    collection = FakeCollection({"_id": "abc"})
+    use_collection(monkeypatch, collection)
+
+    assert asyncio.run(db.delete_task(7, username="jpassweg")) is True
+    assert collection.calls == [("delete", {"taskID": 7}, {"projection": {"_id": 1}})]
+
+    collection.result = None
+    assert asyncio.run(db.delete_task(8, username="jpassweg")) is False
@@ -9,3 +9,28 @@ def test_analyze_text_list():
     assert response.status_code == 200
     response_data = response.json()
     print(response_data)
+
+
+def test_analyze_text_list_keeps_order_and_reports_errors(monkeypatch):
+    import api
+    import json
+
+    async def analyze_text(request):
+        if "fail" in request.messages[-1]:
+            raise ValueError("extraction failed")
+        return {"success": True, "task": {"title": request.messages[-1]}, "message": ""}
+
+    monkeypatch.setattr(api, "analyze_text", analyze_text)
+    request_data = {"text": ["first\nfail\n", "third"]}
+
+    response = client.post("/text_list", json=request_data)
+    assert response.status_code == 200
+    response_data = response.json()
+    assert [item["index"] for item in response_data] == [0, 1, 2]
+    assert response_data[0]["result"]["task"]["title"] == "first"
+    assert response_data[1]["error"] == "extraction failed"
+
+    response = client.post("/text_list?stream=true", json=request_data)
+    assert response.status_code == 200
+    items = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(item["index"] for item in items) == [0, 1, 2]
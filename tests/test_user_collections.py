@@ -0,0 +1,29 @@
+import asyncio
+import mongo_calls as db
+from fastapi.testclient import TestClient
+import api
+
+client = TestClient(api.app)
+
+
+def test_collection_handles_are_cached_per_user(monkeypatch):
+    setups = []
+
+    async def ensure_indexes(task_collection):
+        setups.append(task_collection)
+
+    monkeypatch.setattr(db, "ensure_indexes", ensure_indexes)
+    monkeypatch.setattr(db, "get_task_collection", lambda username: "collection of " + username)
+    db.collections.clear()
+
+    async def lookups():
+        return await asyncio.gather(*[db.get_user_collection(name) for name in ["anna", "anna", "ben", "anna"]])
+
+    assert asyncio.run(lookups()) == ["collection of anna", "collection of anna", "collection of ben", "collection of anna"]
+    assert sorted(setups) == ["collection of anna", "collection of ben"]
+    db.collections.clear()
+
+
+def test_invalid_username_is_rejected():
+    response = client.put("/task/1", headers={"X-User": "../admin"})
+    assert response.status_code == 400
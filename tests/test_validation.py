@@ -0,0 +1,40 @@
+from validation import first_invalid_key
+
+TASK = {
+    "title": "Morning walk in the park",
+    "date": "2024-04-06",
+    "startTime": "10:00",
+    "endTime": "11:00",
+    "activity": "walking",
+    "description": "A relaxing walk in the park",
+    "latitude": "48.720",
+    "longitude": 21.257,
+    "indoor": "False",
+}
+
+
+def test_valid_task():
+    assert first_invalid_key(TASK) is None
+
+
+def test_first_invalid_key_is_reported():
+    assert first_invalid_key({**TASK, "title": "EMPTY"})[0] == "title"
+    assert first_invalid_key({**TASK, "date": "06/04/2024", "startTime": "10"})[0] == "date"
+    assert first_invalid_key({**TASK, "endTime": "25:00"})[0] == "endTime"
+    assert first_invalid_key({**TASK, "activity": "surfing"})[0] == "activity"
+    assert first_invalid_key({**TASK, "latitude": 123})[0] == "latitude"
+    assert first_invalid_key({**TASK, "longitude": "EMPTY"})[0] == "longitude"
+    assert first_invalid_key({**TASK, "indoor": "maybe"})[0] == "indoor"
+
+
+def test_missing_key_is_reported():
+    task = dict(TASK)
+    del task["startTime"]
+    assert first_invalid_key(task)[0] == "startTime"
+
+
+def test_api2_format():
+    from api2 import automatated_comparator, optimal_task
+    assert automatated_comparator(optimal_task) == (True, "")
+    correct, reason = automatated_comparator({**optimal_task, "date": "2024-04-06"})
+    assert not correct and reason.startswith("date")
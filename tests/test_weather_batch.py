@@ -0,0 +1,80 @@
+import asyncio
+from datetime import datetime
+
+import weather
+from cache import TTLCache
+
+STEPS = ["2024-04-06T09:00:00Z", "2024-04-06T12:00:00Z"]
+RAIN = "precipitation-rate_gnd-surf_stat:avg/PT3H"
+TEMP = "minimum-temperature_stat:min/PT3H"
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def multipoint(params):
+    """
+    Answers a MULTIPOINT request with one coverage per point and parameter, the value encodes the point and hour.
+    """
+    points = [p.strip("()").split() for p in params["coords"][len("MULTIPOINT("):-1].split("),(")]
+    hour = int(params["datetime"][11:13])
+    coverages = []
+    for lon, lat in points:
+        for name in params["parameter-name"].split(","):
+            axes = {"x": {"values": [float(lon)]}, "y": {"values": [float(lat)]}, "t": {"values": [params["datetime"]]}}
+            coverages.append({"domain": {"axes": axes}, "ranges": {name: {"values": [float(lat) * 100 + hour]}}})
+    info = {name: {"unit": {"symbol": "K"}, "observedProperty": {"label": {"en": name}}} for name in params["parameter-name"].split(",")}
+    return {"parameters": info, "coverages": coverages}
+
+
+def test_events_are_fetched_per_step_and_grid_cell_and_fanned_out(monkeypatch):
+    requests = []
+
+    async def fake_get(url, params=None, headers=None):
+        requests.append((url, params))
+        return FakeResponse(multipoint(params))
+
+    async def fake_extent(url):
+        monkeypatch.setitem(weather.extent_cache, url, {"times": weather.parse_times(STEPS), "run": datetime(2024, 4, 6, 0)})
+        return weather.parse_times(STEPS).tolist()
+
+    async def fake_select(description, parameters, activity=None):
+        return [RAIN]
+
+    monkeypatch.setattr(weather.edr, "get", fake_get)
+    monkeypatch.setattr(weather, "get_temporal_extent", fake_extent)
+    monkeypatch.setattr(weather, "select_parameters", fake_select)
+    monkeypatch.setattr(weather, "point_cache", TTLCache(64, 60))
+
+    events = [
+        (48.14, 17.1, datetime(2024, 4, 6, 10), datetime(2024, 4, 6, 11), "walk", "walking"),
+        (47.4, 8.5, datetime(2024, 4, 6, 12), datetime(2024, 4, 6, 13), "run", "running"),
+        (48.1, 17.12, datetime(2024, 4, 6, 12, 30), datetime(2024, 4, 6, 13), "walk", "walking"),
+        (48.1, 17.12, datetime(2024, 4, 6, 8), datetime(2024, 4, 6, 9), "walk", "walking"),
+    ]
+    results = asyncio.run(weather.get_weather_batch(events))
+
+    # one request per step for the general and for the temperature collection, each for the cells of that step only
+    assert len(requests) == 4
+    general = {params["datetime"]: params["coords"] for url, params in requests if url == weather.SINGLE_LAYER_2 + "/position"}
+    assert general == {"2024-04-06T09:00:00Z": "MULTIPOINT((17.0 48.0))", "2024-04-06T12:00:00Z": "MULTIPOINT((8.5 47.5),(17.0 48.0))"}
+    assert results[0][RAIN]["value"] == 4809.0
+    assert results[1][RAIN]["value"] == 4762.0
+    assert results[2][RAIN]["value"] == 4812.0
+    assert results[2][TEMP]["value"] == 4812.0
+    assert results[3] is None
+
+    # the forecasts are cached under the keys of get_position
+    requests.clear()
+    run = datetime(2024, 4, 6, 0)
+    cached = asyncio.run(weather.get_position(weather.SINGLE_LAYER_2, 48.1, 17.12, datetime(2024, 4, 6, 12), [RAIN], run=run))
+    assert cached == {RAIN: results[2][RAIN]}
+    assert asyncio.run(weather.get_weather_batch(events)) == results
+    assert requests == []
@@ -0,0 +1,37 @@
+from fastapi.testclient import TestClient
+import api
+
+client = TestClient(api.app)
+
+TASK = {"taskId": 1, "title": "Walk", "date": "2024-04-06", "startTime": "10:00", "endTime": "11:00", "activity": "walking", "description": "A walk", "latitude": 48.72, "longitude": 21.25, "indoor": False}
+
+
+def test_batch_keeps_order_skips_indoor_and_reports_bad_times(monkeypatch):
+    batched = []
+
+    async def fake_get_weather_batch(events):
+        batched.append(events)
+        return [{"rain": {"value": event[0]}} for event in events]
+
+    async def fake_check_suitability(task, weather_data):
+        return {"suitable": weather_data["rain"]["value"] < 48, "reason": task["title"]}
+
+    monkeypatch.setattr(api, "get_weather_batch", fake_get_weather_batch)
+    monkeypatch.setattr(api, "check_suitability", fake_check_suitability)
+    tasks = [
+        {**TASK, "taskId": 1},
+        {**TASK, "taskId": 2, "indoor": True},
+        {**TASK, "taskId": 3, "startTime": "25:00"},
+        {**TASK, "taskId": 4, "latitude": 47.0, "title": "Run"},
+    ]
+    response = client.post("/weather/batch", json={"tasks": tasks})
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["taskId"] for result in results] == [1, 2, 3, 4]
+    assert results[0] == {"taskId": 1, "suitable": False, "reason": "Walk"}
+    assert results[1] == {"taskId": 2, "suitable": True, "reason": "The event is indoor."}
+    assert set(results[2]) == {"taskId", "error"}
+    assert results[3] == {"taskId": 4, "suitable": True, "reason": "Run"}
+    # only the valid outdoor tasks are fetched, in one batch
+    assert len(batched) == 1 and [event[0] for event in batched[0]] == [48.72, 47.0]
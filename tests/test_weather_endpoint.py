@@ -0,0 +1,32 @@
+from fastapi.testclient import TestClient
+import api
+
+client = TestClient(api.app)
+
+TASK = {"taskId": 1, "title": "Walk", "date": "2024-04-06", "startTime": "10:00", "endTime": "11:00", "activity": "walking", "description": "A walk", "latitude": 48.72, "longitude": 21.25, "indoor": False}
+
+
+def test_missing_forecast_is_neither_judged_nor_stored(monkeypatch):
+    stored = []
+
+    async def fake_stored_verdict(task, username):
+        return None
+
+    async def fake_get_weather_data(*args):
+        return None
+
+    async def fake_check_suitability(task, weather_data):
+        raise AssertionError("must not be asked without forecast data")
+
+    async def fake_store_verdict(*args):
+        stored.append(args)
+
+    monkeypatch.setattr(api.prefetch, "stored_verdict", fake_stored_verdict)
+    monkeypatch.setattr(api.prefetch, "store_verdict", fake_store_verdict)
+    monkeypatch.setattr(api, "get_weather_data", fake_get_weather_data)
+    monkeypatch.setattr(api, "check_suitability", fake_check_suitability)
+
+    response = client.post("/weather", json=TASK)
+    assert response.status_code == 200
+    assert response.json() == api.NO_FORECAST
+    assert stored == []
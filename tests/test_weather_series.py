@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import weather
+from weather import find_first_value_less_than_or_equal_to_date, map_series, merge_series, parse_times, step_indices, weather_at, weather_at_many
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def coverage(param, times, values):
+    return {"domain": {"axes": {"t": {"values": times}}}, "ranges": {param: {"values": values}}}
+
+
+def parameter(unit, label):
+    return {"unit": {"symbol": unit}, "observedProperty": {"label": {"en": label}}}
+
+
+TIMES = ["2024-04-06T00:00:00Z", "2024-04-06T03:00:00Z", "2024-04-06T06:00:00Z"]
+
+
+def test_series_is_columnar_and_readable_per_slot():
+    rain = "precipitation-rate_gnd-surf_stat:avg/PT3H"
+    temp = "maximum-temperature_stat:max/PT3H"
+    general = map_series(FakeResponse({
+        "parameters": {rain: parameter("kg m-2 s-1", "Precipitation rate")},
+        "coverages": [coverage(rain, TIMES, [0.0, 0.001, 0.0])],
+    }), [rain])
+    temps = map_series(FakeResponse({
+        "parameters": {temp: parameter("K", "Maximum temperature")},
+        "coverages": [coverage(temp, TIMES[1:], [290.0, 291.0])],
+    }), [temp])
+    series = merge_series(general, temps)
+
+    assert series["time"] == [datetime(2024, 4, 6, 0), datetime(2024, 4, 6, 3), datetime(2024, 4, 6, 6)]
+    assert series["parameters"][temp]["values"] == [None, 290.0, 291.0]
+
+    weather = weather_at(series, datetime(2024, 4, 6, 4, 30))
+    assert weather[rain]["value"] == 0.001
+    assert weather[temp] == {"unit": "K", "description": "Maximum temperature", "value": 290.0}
+    assert weather_at(series, datetime(2024, 4, 5, 23)) is None
+    assert weather_at(series, datetime(2024, 4, 6, 9)) is None
+
+
+def test_steps_are_found_by_binary_search():
+    steps = [datetime(2024, 4, 6, 0), datetime(2024, 4, 6, 3), datetime(2024, 4, 6, 6)]
+    dates = [datetime(2024, 4, 5, 23), datetime(2024, 4, 6, 0), datetime(2024, 4, 6, 5, 59), datetime(2024, 4, 6, 7)]
+
+    assert step_indices(parse_times(TIMES), dates).tolist() == [-1, 0, 1, 2]
+    assert parse_times(TIMES).tolist() == steps
+    assert [find_first_value_less_than_or_equal_to_date(d, steps) for d in dates] == [steps[0], steps[0], steps[1], steps[2]]
+
+
+def test_many_slots_are_read_at_once():
+    rain = "precipitation-rate_gnd-surf_stat:avg/PT3H"
+    series = map_series(FakeResponse({
+        "parameters": {rain: parameter("kg m-2 s-1", "Precipitation rate")},
+        "coverages": [coverage(rain, TIMES, [0.0, 0.001, 0.002])],
+    }), [rain])
+    dates = [datetime(2024, 4, 6, 10), datetime(2024, 4, 6, 1), datetime(2024, 4, 6, 7), datetime(2024, 4, 5, 12)]
+
+    weather = weather_at_many(series, dates)
+    assert [w[rain]["value"] if w else None for w in weather] == [None, 0.0, 0.002, None]
+
+
+def test_extent_steps_are_looked_up_on_the_cached_array(monkeypatch):
+    monkeypatch.setitem(weather.extent_cache, "url", {"times": parse_times(TIMES)})
+    dates = [datetime(2024, 4, 5, 23), datetime(2024, 4, 6, 3), datetime(2024, 4, 6, 5, 59), datetime(2024, 4, 7)]
+
+    assert weather.extent_steps("url", dates) == [datetime(2024, 4, 6, 0), datetime(2024, 4, 6, 3), datetime(2024, 4, 6, 3), datetime(2024, 4, 6, 6)]
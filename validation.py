@@ -0,0 +1,67 @@
+from datetime import datetime
+from typing import ClassVar, Optional, Tuple
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from suitability import ACTIVITIES
+
+# Local replacement of the LLM checks of an extracted task: the models below describe a correctly
+# filled template, first_invalid_key names the first entry that is not.
+
+EMPTY = "EMPTY"
+
+
+class CheckedTask(BaseModel):
+    """
+    A completely and correctly filled task of api.py. Numbers and booleans may still be strings.
+    """
+    date_format: ClassVar[str] = "%Y-%m-%d"
+
+    title: str
+    date: str
+    startTime: str
+    endTime: str
+    activity: str
+    description: str
+    latitude: float = Field(ge=-90, le=90)
+    longitude: float = Field(ge=-180, le=180)
+    indoor: bool
+
+    @field_validator("title", "description", mode="before")
+    @classmethod
+    def check_filled(cls, value):
+        if not isinstance(value, str) or not value.strip() or value.strip() == EMPTY:
+            raise ValueError("must be filled in")
+        return value
+
+    @field_validator("date")
+    @classmethod
+    def check_date(cls, value):
+        datetime.strptime(value, cls.date_format)
+        return value
+
+    @field_validator("startTime", "endTime")
+    @classmethod
+    def check_time(cls, value):
+        datetime.strptime(value, "%H:%M")
+        return value
+
+    @field_validator("activity")
+    @classmethod
+    def check_activity(cls, value):
+        if value not in ACTIVITIES:
+            raise ValueError(f"must be one of {', '.join(ACTIVITIES)}")
+        return value
+
+
+def first_invalid_key(task: dict, model=CheckedTask) -> Optional[Tuple[str, str]]:
+    """
+    Returns (key, reason) of the first entry of task that is missing or invalid, in the field order of model,
+    or None if the task is filled in correctly.
+    """
+    try:
+        model.model_validate(task)
+    except ValidationError as e:
+        error = e.errors()[0]
+        key = str(error["loc"][0]) if error["loc"] else ""
+        return key, f"{error['msg']} (got {task.get(key)!r})"
+    return None
@@ -1,22 +1,40 @@
-import requests
+import asyncio
 import json
-from datetime import datetime, timedelta
-from openai import OpenAI
-from dotenv import load_dotenv
 import os
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
 
+import httpx
+import numpy as np
 
-headers = {
-    "accept": "application/json"
-}
+import coveragejson
+import edr
+import llm
+from cache import TTLCache
+from singleflight import SingleFlight
+from suitability import rule_parameters, strip_period
+
+# Seconds a cached collection extent is trusted before it is revalidated with a conditional request
+EXTENT_TTL = float(os.environ.get("EDR_EXTENT_TTL", "600"))
+# Seconds a cached extent is used again before retrying when its revalidation failed
+EXTENT_RETRY = float(os.environ.get("EDR_EXTENT_RETRY", "30"))
+
+# Point forecasts are cached per GFS grid cell, see get_position
+GRID_STEP = 0.5
+POINT_CACHE_SIZE = int(os.environ.get("POINT_CACHE_SIZE", "4096"))
+POINT_CACHE_TTL = float(os.environ.get("POINT_CACHE_TTL", "3600"))
+
+# Grid cells per MULTIPOINT request of get_weather_batch
+WEATHER_BATCH_MAX_POINTS = int(os.environ.get("WEATHER_BATCH_MAX_POINTS", "50"))
+
+# Parameters picked by the LLM for descriptions that match no activity, see select_parameters
+PARAMETER_CACHE_SIZE = int(os.environ.get("PARAMETER_CACHE_SIZE", "1024"))
+PARAMETER_CACHE_TTL = float(os.environ.get("PARAMETER_CACHE_TTL", "86400"))
 
 # OpenAI API variables
 
 model = "gpt-4-1106-preview"
-load_dotenv()
-client = OpenAI(
-    api_key=os.environ.get("OPENAI_API_KEY"),
-)
 
 
 
@@ -129,55 +147,204 @@ def extract_relevant_info(entry):
 def convert_to_date(date):
     return datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
 
-def get_dates(from_date, url):
+
+parse_times = coveragejson.parse_times
+
+
+def step_indices(times, dates) -> np.ndarray:
+    """
+    Returns for each of dates the index of the last of the sorted times that is at or before it,
+    -1 for dates before the first time. One binary search per date, all done in one vectorized call.
+    """
+    return np.searchsorted(np.asarray(times, dtype="datetime64[s]"), np.asarray(dates, dtype="datetime64[s]"), side="right") - 1
+
+# Temporal extent of each collection: url -> {"times", "values", "run", "etag", "last_modified", "expires"}
+# "times" is the sorted datetime64 array of the forecast steps, "values" the same steps as datetimes
+extent_cache = {}
+extent_stats = {"hits": 0, "misses": 0, "revalidated": 0, "new_runs": 0, "stale": 0}
+# Revalidations of an extent in progress, keyed by url
+extent_flights = SingleFlight()
+
+
+async def get_temporal_extent(url):
+    """
+    Returns the parsed temporal extent (list of forecast steps) of a collection.
+
+    The extent only changes when a new GFS run is published, so it is kept in memory for EXTENT_TTL seconds.
+    After that it is revalidated with If-None-Match / If-Modified-Since; a 304 keeps the cached steps.
+    If the revalidation fails, the cached steps are used for another EXTENT_RETRY seconds.
+    Concurrent callers share one revalidation.
+    """
+    entry = extent_cache.get(url)
+    if entry is not None and time.monotonic() < entry["expires"]:
+        extent_stats["hits"] += 1
+        return entry["values"]
+    return await extent_flights.do(url, refresh_temporal_extent, url)
+
+
+async def refresh_temporal_extent(url):
+    entry = extent_cache.get(url)
+    now = time.monotonic()
+    request_headers = {}
+    if entry is not None:
+        if entry["etag"]:
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            request_headers["If-Modified-Since"] = entry["last_modified"]
     try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            values = data['extent']['temporal']['values']
-            values = list(map(lambda x: convert_to_date(x), values))
-            if from_date < values[0]:
-                raise Exception('Event has already started')
-            return find_first_value_less_than_or_equal_to_date(from_date, values)
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
-            return None
+        response = await edr.get(url, headers=request_headers)
+        status_code = response.status_code
+    except httpx.TransportError:
+        if entry is None:
+            raise
+        status_code = None
+    if entry is not None and status_code == 304:
+        extent_stats["revalidated"] += 1
+        entry["expires"] = now + EXTENT_TTL
+        return entry["values"]
+    if entry is not None and status_code != 200:
+        extent_stats["stale"] += 1
+        entry["expires"] = now + EXTENT_RETRY
+        return entry["values"]
+    if status_code != 200:
+        raise Exception(f"Failed to fetch collection metadata. Status code: {response.status_code}")
+    extent_stats["misses"] += 1
+    data = response.json()
+    times = np.sort(parse_times(data['extent']['temporal']['values']))
+    values = times.tolist()
+    if entry is not None and entry["run"] != values[0]:
+        extent_stats["new_runs"] += 1
+    extent_cache[url] = {
+        "times": times,
+        "values": values,
+        "run": values[0],
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "expires": now + EXTENT_TTL,
+    }
+    return values
+
+
+def forecast_run(url):
+    """
+    Returns the first forecast step of the cached extent of a collection, which identifies the current GFS run.
+    """
+    entry = extent_cache.get(url)
+    return entry["run"] if entry is not None else None
+
+
+def extent_steps(url, dates) -> list:
+    """
+    Returns for each of dates the forecast step of the cached extent of a collection that contains it,
+    or the first step for dates before the extent. All dates are looked up in one call on the datetime64 array.
+    """
+    times = extent_cache[url]["times"]
+    return times[np.maximum(step_indices(times, dates), 0)].tolist()
+
+
+async def get_dates(from_date, url):
+    try:
+        values = await get_temporal_extent(url)
+        if from_date < values[0]:
+            raise Exception('Event has already started')
+        return extent_steps(url, [from_date])[0]
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return None
 
 def find_first_value_less_than_or_equal_to_date(date, value_list):
-    previous_element = value_list[0]
-    for value in value_list[1:]:
-        if value <= date:
-            previous_element = value
-        else:
-            return previous_element
-    if previous_element == value_list[-1]:
-        return previous_element
-    raise Exception('Unexpected error')
-
-def get_weather_data(x, y, from_date, to_date, description):
-    duration = abs(to_date-from_date)
-    url = None
+    """
+    Returns the last of the sorted value_list that is at or before date, or the first one if date is before all of them.
+    """
+    return value_list[max(bisect_right(value_list, date) - 1, 0)]
+
+# Length of the forecast steps of the collections of get_collections
+COLLECTION_STEPS = {
+    SINGLE_LAYER_2: timedelta(hours=3),
+    SINGLE_LAYER_3: timedelta(hours=6),
+}
+
+
+def get_collections(duration):
+    """
+    Returns (url, temp_url, temp_params, parameters) of the collections that match the duration of an event.
+    """
     if duration <= timedelta(hours=3):
-        url = SINGLE_LAYER_2
-        temp_url = HEIGHT_ABOVE_GROUND_2
-        temp_params = HEIGHT_ABOVE_GROUND_2_PARAMS
-        parameters = SINGLE_LAYER_2_PARAMETERS
+        return SINGLE_LAYER_2, HEIGHT_ABOVE_GROUND_2, HEIGHT_ABOVE_GROUND_2_PARAMS, SINGLE_LAYER_2_PARAMETERS
+    return SINGLE_LAYER_3, HEIGHT_ABOVE_GROUND_3, HEIGHT_ABOVE_GROUND_3_PARAMS, SINGLE_LAYER_3_PARAMETERS
+
+
+# Parameters (without their aggregation period) that matter for each activity class.
+# The parameters of the suitability rules are always added on top.
+ACTIVITY_PARAMETERS = {
+    "coffee": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg", "downward-short-wave-radiation-flux_gnd-surf_stat:avg", "convective-precipitation_gnd-surf_stat:acc"],
+    "drink": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg", "downward-short-wave-radiation-flux_gnd-surf_stat:avg", "convective-precipitation_gnd-surf_stat:acc"],
+    "eat": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg", "downward-short-wave-radiation-flux_gnd-surf_stat:avg", "convective-precipitation_gnd-surf_stat:acc"],
+    "meeting": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg", "downward-short-wave-radiation-flux_gnd-surf_stat:avg", "convective-precipitation_gnd-surf_stat:acc"],
+    "party": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg", "convective-precipitation_gnd-surf_stat:acc", "total-precipitation_gnd-surf_stat:acc"],
+    "running": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "categorical-snow-yes-1-no-0_gnd-surf_stat:avg", "categorical-freezing-rain-yes-1-no-0_gnd-surf_stat:avg", "categorical-ice-pellets-yes-1-no-0_gnd-surf_stat:avg"],
+    "walking": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "categorical-snow-yes-1-no-0_gnd-surf_stat:avg", "categorical-freezing-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg"],
+    "working": ["precipitation-rate_gnd-surf_stat:avg", "categorical-rain-yes-1-no-0_gnd-surf_stat:avg", "total-cloud-cover_atmosphere_stat:avg", "downward-short-wave-radiation-flux_gnd-surf_stat:avg", "convective-precipitation_gnd-surf_stat:acc"],
+}
+
+# Words in a description that identify an activity class when the task has none (or "other")
+ACTIVITY_KEYWORDS = {
+    "coffee": ["coffee", "cafe", "café", "espresso", "tea"],
+    "drink": ["drink", "beer", "wine", "bar", "cocktail", "pub"],
+    "eat": ["eat", "lunch", "dinner", "breakfast", "brunch", "picnic", "barbecue", "bbq", "restaurant"],
+    "meeting": ["meeting", "meet", "appointment"],
+    "party": ["party", "celebration", "birthday", "festival", "concert"],
+    "running": ["run", "running", "jog", "jogging", "marathon"],
+    "walking": ["walk", "walking", "hike", "hiking", "stroll"],
+    "working": ["work", "working", "office"],
+}
+
+parameter_cache = TTLCache(PARAMETER_CACHE_SIZE, PARAMETER_CACHE_TTL)
+
+
+def normalize_description(description):
+    return " ".join(str(description).lower().split())
+
+
+def classify_activity(activity, description):
+    """
+    Returns the activity class of an event, from its activity field or else from keywords in its description.
+    Returns None if neither matches a class of ACTIVITY_PARAMETERS.
+    """
+    if activity in ACTIVITY_PARAMETERS:
+        return activity
+    words = set(normalize_description(description).replace(",", " ").replace(".", " ").split())
+    for activity_class, keywords in ACTIVITY_KEYWORDS.items():
+        if words.intersection(keywords):
+            return activity_class
+    return None
+
+
+async def select_parameters(description, parameters, activity=None):
+    """
+    Returns the parameters of a collection that are needed to judge the weather for an event.
+
+    Known activity classes use the static ACTIVITY_PARAMETERS mapping. Only descriptions that match no class
+    ask the LLM, and its answer is memoized by the normalized description.
+    """
+    activity_class = classify_activity(activity, description)
+    if activity_class is not None:
+        stems = ACTIVITY_PARAMETERS[activity_class]
+        selected = [p for p in parameters if strip_period(p) in stems]
     else:
-        url = SINGLE_LAYER_3
-        temp_url = HEIGHT_ABOVE_GROUND_3
-        temp_params = HEIGHT_ABOVE_GROUND_3_PARAMS
-        parameters = SINGLE_LAYER_3_PARAMETERS
-    try:
-        date_value = get_dates(from_date, url)
-    except Exception as e:
-        print("Error: Date in the past" + str(e))
-        return None
+        key = (normalize_description(description), tuple(parameters))
+        selected = parameter_cache.get(key)
+        if selected is None:
+            selected = await select_parameters_llm(description, parameters)
+            parameter_cache.set(key, selected)
+    # the suitability rules always need their parameters, whatever was selected
+    return selected + [p for p in rule_parameters(parameters) if p not in selected]
 
-    completion = client.chat.completions.create(
+
+async def select_parameters_llm(description, parameters):
+    completion_message_content = await llm.complete(
       model=model,
+      cache=True,
       response_format={ "type": "json_object" },
       messages=[
         {"role": "system", "content": "You are an expert in predicting how good an activity is based on the weather forecast. You receive a question about a planned activity and a list of possible parameters. Decide based on the activity which parameters you require from the list to answer the query as good as possible. Make sure to only answer parameters that appear in the list. You return a json list of parameters that you need to answer the question in this form: {required_parameters: [parameter1, parameter2, ...]}. Pick only the 5 most important ones." },
@@ -186,37 +353,319 @@ def get_weather_data(x, y, from_date, to_date, description):
       ]
     )
 
-    completion_message_content = completion.choices[0].message.content
-
     extracted_json = json.loads(completion_message_content)
 
-    parameters= extracted_json['required_parameters']
+    return [p for p in extracted_json['required_parameters'] if p in parameters]
+
+
+async def get_weather_data(x, y, from_date, to_date, description, activity=None):
+    url, temp_url, temp_params, parameters = get_collections(abs(to_date-from_date))
+    try:
+        date_value = await get_dates(from_date, url)
+    except Exception as e:
+        print("Error: Date in the past" + str(e))
+        return None
+    if date_value is None:
+        return None
+
+    parameters = await select_parameters(description, parameters, activity)
+
+    run = forecast_run(url)
+    try:
+        general_data = await get_position(url, x, y, date_value, parameters, run=run)
+        if general_data is None:
+            return None
+        temp_data = await get_position(temp_url, x, y, date_value, list(temp_params), z=2, run=run)
+        return {**general_data,**(temp_data or {})}
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        return None
+
+
+# Mapped /position responses keyed by (collection, grid cell, valid time, level, parameters, forecast run)
+point_cache = TTLCache(POINT_CACHE_SIZE, POINT_CACHE_TTL)
+# /position requests in progress, under the same keys as point_cache
+position_flights = SingleFlight()
+
 
+def snap_to_grid(value, step=GRID_STEP):
+    return round(round(value / step) * step, 4)
+
+
+async def get_position(url, x, y, date_value, parameters, z=None, run=None):
+    """
+    Queries the forecast of the given parameters at latitude x and longitude y for one forecast step.
+
+    The coordinates are rounded to the nearest point of the 0.5 degree GFS grid, so nearby events that round to
+    the same grid point and forecast step share one cache entry instead of one request each. Identical requests
+    that arrive while the first is still running wait for its response.
+    """
+    lat, lon = snap_to_grid(x), snap_to_grid(y)
+    parameters = sorted(parameters)
+    key = (url, lat, lon, date_value, z, tuple(parameters), run)
+    cached = point_cache.get(key)
+    if cached is not None:
+        return cached
     params = {
-        'coords': f'POINT({y} {x})',
+        'coords': f'POINT({lon} {lat})',
         'datetime': date_value.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'parameter-name': ','.join(parameters),
     }
+    if z is not None:
+        params['z'] = z
+    return await position_flights.do(key, fetch_position, key, url, params, parameters, map_response)
+
 
+async def fetch_position(key, url, params, parameters, mapper):
+    """
+    Sends one /position request, maps the response with mapper and caches it in point_cache under key.
+    """
+    response = await edr.get(url + '/position', params=params)
+    if response.status_code != 200:
+        print(f"Failed to fetch data. Status code: {response.status_code}")
+        return None
+    data = mapper(response, parameters)
+    point_cache.set(key, data)
+    return data
+
+
+async def get_weather_series(x, y, from_date, to_date, description, duration=timedelta(hours=1), activity=None, rules_only=False):
+    """
+    Fetches every forecast step between from_date and to_date at latitude x and longitude y.
+
+    Uses one /position request with a datetime interval per collection instead of one request per step.
+    The collections are chosen by the duration of a single slot, as in get_weather_data.
+    With rules_only only the parameters of the suitability rules are fetched, whatever the description.
+
+    Returns a columnar structure, or None if the forecast is not available:
+    {
+        "time": [datetime, ...],
+        "step": timedelta, the length of one forecast step of the collection,
+        "parameters": {parameter: {"unit": "", "description": "", "values": [value per step]}}
+    }
+    Use weather_at to read the weather of one slot in the format of get_weather_data.
+    """
+    url, temp_url, temp_params, parameters = get_collections(duration)
     try:
-        # Sending a GET request with parameters
-        response = requests.get(url + '/position', params=params)
-        if response.status_code == 200:
-            general_data = map_response(response, parameters)
-            params['z'] = 2
-            response = requests.get(temp_url + '/position', params=params)
-            temp_data = map_response(response, temp_params)
-            return {**general_data,**temp_data}
-        else:
-            print(f"Failed to fetch data. Status code: {response.status_code}")
+        values = await get_temporal_extent(url)
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        return None
+    if to_date < values[0] or from_date > values[-1]:
+        return None
+    start = extent_steps(url, [from_date])[0]
+    end = min(to_date, values[-1])
+
+    if rules_only:
+        parameters = rule_parameters(parameters)
+    else:
+        parameters = await select_parameters(description, parameters, activity)
+
+    run = forecast_run(url)
+    try:
+        general_data = await get_position_series(url, x, y, start, end, parameters, run=run)
+        if general_data is None:
             return None
+        temp_data = await get_position_series(temp_url, x, y, start, end, list(temp_params), z=2, run=run)
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         return None
-    
+    if temp_data is not None:
+        general_data = merge_series(general_data, temp_data)
+    return {**general_data, 'step': COLLECTION_STEPS[url]}
+
+
+async def get_position_series(url, x, y, start, end, parameters, z=None, run=None):
+    """
+    Same as get_position, but for all forecast steps from start to end.
+    """
+    lat, lon = snap_to_grid(x), snap_to_grid(y)
+    parameters = sorted(parameters)
+    key = (url, lat, lon, (start, end), z, tuple(parameters), run)
+    cached = point_cache.get(key)
+    if cached is not None:
+        return cached
+    params = {
+        'coords': f'POINT({lon} {lat})',
+        'datetime': f"{start.strftime('%Y-%m-%dT%H:%M:%SZ')}/{end.strftime('%Y-%m-%dT%H:%M:%SZ')}",
+        'parameter-name': ','.join(parameters),
+    }
+    if z is not None:
+        params['z'] = z
+    return await position_flights.do(key, fetch_position, key, url, params, parameters, map_series)
+
+
+async def get_weather_batch(events):
+    """
+    Same as get_weather_data for many events at once.
+
+    events is a list of (x, y, from_date, to_date, description, activity). The events are grouped by collection,
+    their locations are deduplicated to grid cells and every forecast step is fetched with MULTIPOINT requests
+    for all of its cells, so many events cost a few requests instead of two each.
+
+    Returns the weather data of each event in input order, None where get_weather_data would return None.
+    """
+    groups = {}
+    for index, event in enumerate(events):
+        collections = get_collections(abs(event[3] - event[2]))
+        groups.setdefault(collections[0], (collections, []))[1].append((index, event))
+    results = {}
+    for found in await asyncio.gather(*(get_collection_batch(collections, group) for collections, group in groups.values())):
+        results.update(found)
+    return [results.get(index) for index in range(len(events))]
+
+
+async def get_collection_batch(collections, events):
+    """
+    Fetches the events of one collection for get_weather_batch.
+
+    Returns {index of the event: weather data} for the events that have a forecast.
+    """
+    url, temp_url, temp_params, parameters = collections
+    try:
+        values = await get_temporal_extent(url)
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        return {}
+    # as get_dates, events that start before the first forecast step have no forecast
+    events = [(index, event) for index, event in events if event[2] >= values[0]]
+    if not events:
+        return {}
+    steps = dict(zip([index for index, _ in events], extent_steps(url, [event[2] for _, event in events])))
+    selected = await asyncio.gather(*(select_parameters(event[4], parameters, event[5]) for _, event in events))
+    selected = {index: tuple(sorted(params)) for (index, _), params in zip(events, selected)}
+    temp_key = tuple(sorted(temp_params))
+    cells = {index: (snap_to_grid(event[0]), snap_to_grid(event[1])) for index, event in events}
+
+    # one request per forecast step and parameter set, so the responses only hold what the events need
+    general_requests, temp_requests = {}, {}
+    for index, _ in events:
+        general_requests.setdefault((steps[index], selected[index]), set()).add(cells[index])
+        temp_requests.setdefault((steps[index], temp_key), set()).add(cells[index])
+    run = forecast_run(url)
+    try:
+        general_data, temp_data = await asyncio.gather(
+            get_points(url, general_requests, run),
+            get_points(temp_url, temp_requests, run, z=2),
+        )
+    except Exception as e:
+        print(f"An error occurred: {str(e)}")
+        return {}
+    results = {}
+    for index, _ in events:
+        general = general_data.get((cells[index], steps[index], selected[index]))
+        if general is not None:
+            results[index] = {**general, **(temp_data.get((cells[index], steps[index], temp_key)) or {})}
+    return results
+
+
+async def get_points(url, requests, run, z=None):
+    """
+    Fetches the forecast of many grid cells. requests maps (step, sorted parameter tuple) to a set of
+    (latitude, longitude) cells.
+
+    Cells that are in point_cache under the key of get_position are not requested again. The others are fetched
+    with one MULTIPOINT request per step and parameter set and at most WEATHER_BATCH_MAX_POINTS cells, and cached
+    under that key, so /weather and the batch share their forecasts.
+
+    Returns {(cell, step, parameters): weather data in the format of get_position}.
+    """
+    found = {}
+    fetches = []
+    for (step, parameters), cells in requests.items():
+        missing = []
+        for cell in sorted(cells):
+            cached = point_cache.get((url, cell[0], cell[1], step, z, parameters, run))
+            if cached is not None:
+                found[(cell, step, parameters)] = cached
+            else:
+                missing.append(cell)
+        for i in range(0, len(missing), WEATHER_BATCH_MAX_POINTS):
+            fetches.append((step, parameters, missing[i:i + WEATHER_BATCH_MAX_POINTS]))
+    fetched = await asyncio.gather(*(get_multipoint(url, chunk, step, parameters, z) for step, parameters, chunk in fetches))
+    for (step, parameters, _), data in zip(fetches, fetched):
+        for cell, weather_data in data.items():
+            point_cache.set((url, cell[0], cell[1], step, z, parameters, run), weather_data)
+            found[(cell, step, parameters)] = weather_data
+    return found
+
+
+async def get_multipoint(url, cells, date_value, parameters, z=None):
+    """
+    Queries the forecast of the given parameters at many (latitude, longitude) grid cells for one forecast step.
+
+    Returns {cell: weather data in the format of get_position}, without the cells missing from the response.
+    """
+    params = {
+        'coords': 'MULTIPOINT(' + ','.join(f'({lon} {lat})' for lat, lon in cells) + ')',
+        'datetime': date_value.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'parameter-name': ','.join(parameters),
+    }
+    if z is not None:
+        params['z'] = z
+    response = await edr.get(url + '/position', params=params)
+    if response.status_code != 200:
+        print(f"Failed to fetch data. Status code: {response.status_code}")
+        return {}
+    columns = coveragejson.decode(coveragejson.read_response(response))
+    found = {}
+    for row, (x, y) in enumerate(columns['points']):
+        # coverages without coordinates can only be matched if the request had one point
+        if x is None:
+            if len(cells) != 1:
+                continue
+            cell = cells[0]
+        else:
+            cell = (snap_to_grid(y), snap_to_grid(x))
+        found[cell] = {param: {'unit': column['unit'], 'description': column['description'], 'value': coveragejson.to_list(column['values'][row])[0]} for param, column in columns['parameters'].items() if param in parameters and column['unit'] is not None}
+    return found
+
+
+def map_series(response, parameters):
+    columns = coveragejson.decode(coveragejson.read_response(response))
+    return {
+        'time': columns['time'].tolist(),
+        'parameters': {param: {'unit': column['unit'], 'description': column['description'], 'values': coveragejson.to_list(column['values'][0])} for param, column in columns['parameters'].items() if param in parameters and column['unit'] is not None}
+    }
+
+
+def merge_series(series, other):
+    """
+    Adds the parameters of other to series, aligned on the time axis of series.
+    """
+    parameters = dict(series['parameters'])
+    for param, column in other['parameters'].items():
+        by_time = dict(zip(other['time'], column['values']))
+        parameters[param] = {**column, 'values': [by_time.get(t) for t in series['time']]}
+    return {'time': series['time'], 'parameters': parameters}
+
+
+def weather_at(series, date):
+    """
+    Returns the weather of the forecast step that contains date, in the format of get_weather_data.
+    Returns None if date lies outside of the series.
+    """
+    return weather_at_many(series, [date])[0]
+
+
+def weather_at_many(series, dates):
+    """
+    Same as weather_at for many dates, whose forecast steps are looked up in one vectorized call.
+    """
+    if series is None or not series['time']:
+        return [None for _ in dates]
+    times = series['time']
+    # series of get_weather_series know their step, for others it is guessed from the time axis
+    step = series.get('step') or (times[-1] - times[-2] if len(times) > 1 else timedelta(hours=3))
+    result = []
+    for date, index in zip(dates, step_indices(times, dates).tolist()):
+        if index < 0 or date >= times[-1] + step:
+            result.append(None)
+        else:
+            result.append({param: {'unit': column['unit'], 'description': column['description'], 'value': column['values'][index]} for param, column in series['parameters'].items()})
+    return result
+
 
 def map_response(response, parameters):
-    temp =  response.json()
-    gen_info = temp['parameters']
-    values = list(map(lambda x: x['ranges'],temp['coverages']))
-    values = {list(value.keys())[0]:list(value.values())[0] for value in values}
-    return {param: {'unit':gen_info[param]['unit']['symbol'], 'description':gen_info[param]['observedProperty']['label']['en'], 'value': values[param]['values'][0]} for param in parameters if param in values and param in gen_info}
\ No newline at end of file
+    columns = coveragejson.decode(coveragejson.read_response(response))
+    return {param: {'unit': column['unit'], 'description': column['description'], 'value': coveragejson.to_list(column['values'][0])[0]} for param, column in columns['parameters'].items() if param in parameters and column['unit'] is not None}
\ No newline at end of file